@@ -0,0 +1,77 @@
+"""
+Speed of the stochastic solvers on the WT configuration of the final
+model (53 AVP, 27 VIP, 40 NAV cells, kav = 2.5), from random initial
+phases on the limit cycle as in the sweeps.
+
+Each solver simulates a few hours of model time per replicate. The
+script prints the wall time per simulated hour, the events per second
+(estimated from the total propensity along the recorded trajectory) and
+the projected wall time of one 7-period trajectory. Solvers are named on
+the command line, default StochKit and the exact in-process methods,
+plus the compiled direct method (solver='jit') if numba is installed.
+StochKit should remain the default of model.run() until an in-process
+solver beats it here.
+
+John Abel
+"""
+
+from __future__ import division
+import sys
+assert sys.version[0]=='2', "This file must be run in python 2"
+import pickle
+from time import time
+
+import numpy as np
+
+from local_imports import LimitCycle as lc
+from local_models.gonze_model import param, ODEmodel, EqCount
+
+# find original period
+single_osc = lc.Oscillator(ODEmodel(), param, y0=np.ones(EqCount))
+# y0, period and limit cycle, computed once and then read from the cache
+single_osc.cached_limit_cycle('data/limit_cycles', trans=2000)
+wt_T = single_osc.T
+
+# number of each celltype, as hard-coded in the final model
+AVPcells = 53; VIPcells=27; NAVcells = 40
+
+from local_models.stoch_model_final import param, compile_model
+from local_models.scn_model import random_phase_y0
+from local_models.seeding import SeedTree
+from local_models.jit_ssa import numba
+
+solvers = sys.argv[1:] or (['stochkit', 'direct', 'nrm', 'mnrm'] +
+                           (['jit'] if numba is not None else []))
+replicates = 3
+hours = 2.
+seeds = SeedTree(0)
+
+compiled = compile_model()
+compiled.tspan = np.linspace(0, hours, int(4*hours)+1)
+network = compiled.network()
+
+results = {}
+for solver in solvers:
+    wall = 0.
+    events = 0.
+    for tn in range(replicates):
+        y0_random = random_phase_y0(single_osc, AVPcells, VIPcells, NAVcells,
+                                    seeds.child(tn, 'initial').random_state())
+        start = time()
+        traj = compiled.run(y0_random, show_labels=False,
+                            seed=seeds.child(tn, solver), solver=solver)[0]
+        wall += time() - start
+        # total propensity along the trajectory gives the expected events
+        a0 = network.propensities(network.initial_state(traj[:, 1:])).sum(1)
+        events += np.trapz(a0, traj[:, 0])
+    results[solver] = {'wall_per_hour': wall/(replicates*hours),
+                       'events_per_second': events/wall,
+                       'events_per_hour': events/(replicates*hours)}
+    print ("%-12s %8.1f s per simulated h, %8.0f events/s, "
+           "%0.1f h per 7-period run") % (
+            solver, results[solver]['wall_per_hour'],
+            results[solver]['events_per_second'],
+            results[solver]['wall_per_hour']*7*wt_T/3600.)
+
+with open("results/solver_benchmark.pickle", "wb") as output_file:
+    pickle.dump(results, output_file)
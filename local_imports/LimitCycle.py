@@ -10,7 +10,10 @@ solving models. Any general methods will be here.
 """
 
 from __future__ import division
+import os
+import hashlib
 import cPickle as pickle
+from collections import OrderedDict
 import numpy as np
 import casadi as cs
 import pylab as pl
@@ -19,6 +22,8 @@ import Utilities as jha
 import pdb
 from scipy import signal
 from scipy.interpolate import splrep, splev, UnivariateSpline
+from scipy.optimize import brentq
+from scipy.special import i0e, i1e
 
 
 class Oscillator(object):
@@ -26,6 +31,12 @@ class Oscillator(object):
     This circadian oscillator class is for deterministic ODE simulations.
     """
 
+    # states per call of the batched model function, see _batched
+    batch_size = 64
+
+    # pooled CasADi functions kept per purpose, see _pooled
+    pool_size = 4
+
     def __init__(self, model, param, y0=None, period_guess=24.):
         """
         Setup the required information.
@@ -123,6 +134,75 @@ class Oscillator(object):
 
         self.modlT.setOption("name","T-shifted model")
 
+    def _pooled(self, key, build, keep=None):
+        """
+        Initialized CasADi function for key from the pool of this
+        oscillator, built by build() on first use. Callers only set
+        inputs, so repeated calls skip construction and init().
+
+        The pool keeps the pool_size most recently used functions of
+        each purpose (key[0]) and evicts the rest, so scans over periods
+        or output times do not grow it without bound. keep is held with
+        the entry, e.g. the integrator whose id is part of the key, so
+        that id stays unique while the entry lives.
+        """
+        if not hasattr(self, '_pool'): self._pool = OrderedDict()
+        if key in self._pool:
+            entry = self._pool.pop(key)
+        else:
+            fn = build()
+            fn.init()
+            entry = (fn, keep)
+            purpose = [k for k in self._pool if k[0] == key[0]]
+            for old in purpose[:max(0, len(purpose) + 1 - self.pool_size)]:
+                del self._pool[old]
+        self._pool[key] = entry
+        return entry[0]
+
+    def _integrator(self, purpose, options, tf, model=None):
+        """
+        Pooled CVODES integrator to time tf with the setOption values in
+        options, keyed by (purpose, options, tf). model, a callable
+        returning the SXFunction to integrate, is only called when the
+        integrator is built; the default integrates self.model.
+        """
+        options = dict(options, tf=tf)
+        def build():
+            integrator = cs.Integrator('cvodes', self.model if model is None
+                                       else model())
+            for name, value in sorted(options.items()):
+                integrator.setOption(name, value)
+            return integrator
+        return self._pooled((purpose, tuple(sorted(options.items()))), build)
+
+    def _simulator(self, purpose, options, ts):
+        """ Pooled Simulator of _integrator(purpose, options, ts[-1]) """
+        integrator = self._integrator(purpose, options, ts[-1])
+        ts = np.asarray(ts, dtype=float)
+        return self._pooled((purpose, id(integrator), len(ts),
+                             hashlib.sha1(ts.tostring()).hexdigest()),
+                            lambda: cs.Simulator(integrator, ts),
+                            keep=integrator)
+
+    def _jacobian(self, integrator, iind, oind):
+        """ Pooled jacobian of a pooled integrator """
+        return self._pooled(('jacobian', id(integrator), iind, oind),
+                            lambda: integrator.jacobian(iind, oind),
+                            keep=integrator)
+
+    def _sens_options(self, max_num_steps):
+        """ integrator options for forward sensitivities """
+        return {
+            "abstol"             : self.intoptions['sensabstol'],
+            "reltol"             : self.intoptions['sensreltol'],
+            "max_num_steps"      : max_num_steps,
+            "sensitivity_method" : self.intoptions['sensmethod'],
+            "t0"                 : 0,
+            "fsens_err_con"      : 1,
+            "fsens_abstol"       : self.intoptions['sensabstol'],
+            "fsens_reltol"       : self.intoptions['sensreltol'],
+            }
+
 
     def int_odes(self, tf, y0=None, numsteps=10000, return_endpt=False, ts=0,
                     silent=False):
@@ -134,22 +214,19 @@ class Oscillator(object):
         """
         if y0 is None: y0 = self.y0
 
-        self.integrator = cs.Integrator('cvodes',self.model)
-
         #Set up the tolerances etc.
-        self.integrator.setOption("abstol", self.intoptions['int_abstol'])
-        self.integrator.setOption("reltol", self.intoptions['int_reltol'])
-        self.integrator.setOption("max_num_steps",
-            self.intoptions['int_maxstepcount'])
-        self.integrator.setOption("tf",tf)
+        options = {
+            "abstol"        : self.intoptions['int_abstol'],
+            "reltol"        : self.intoptions['int_reltol'],
+            "max_num_steps" : self.intoptions['int_maxstepcount'],
+            }
         if silent:
-            self.integrator.setOption("disable_internal_warnings", True)
+            options["disable_internal_warnings"] = True
 
         #Let's integrate
-        self.integrator.init()
         self.ts = np.linspace(ts,tf, numsteps, endpoint=True)
-        self.simulator = cs.Simulator(self.integrator, self.ts)
-        self.simulator.init()
+        self.integrator = self._integrator('int_odes', options, tf)
+        self.simulator = self._simulator('int_odes', options, self.ts)
         self.simulator.setInput(y0,cs.INTEGRATOR_X0)
         self.simulator.setInput(self.param,cs.INTEGRATOR_P)
         self.simulator.evaluate()
@@ -201,13 +278,12 @@ class Oscillator(object):
 
 
         # Here we create and initialize the integrator SXFunction
-        self.bvpint = cs.Integrator('cvodes',self.modlT)
-        self.bvpint.setOption('abstol',self.intoptions['bvp_abstol'])
-        self.bvpint.setOption('reltol',self.intoptions['bvp_reltol'])
-        self.bvpint.setOption('tf',1)
-        self.bvpint.setOption('disable_internal_warnings', True)
-        self.bvpint.setOption('fsens_err_con', True)
-        self.bvpint.init()
+        self.bvpint = self._integrator('bvp', {
+            'abstol'                    : self.intoptions['bvp_abstol'],
+            'reltol'                    : self.intoptions['bvp_reltol'],
+            'disable_internal_warnings' : True,
+            'fsens_err_con'             : True,
+            }, 1, model=lambda: self.modlT)
 
         def bvp_minimize_function(x):
             """ Minimization objective. X = [y0,T] """
@@ -255,13 +331,12 @@ class Oscillator(object):
         Related to PCSJ code.
         """
 
-        self.bvpint = cs.Integrator('cvodes',self.modlT)
-        self.bvpint.setOption('abstol',self.intoptions['bvp_abstol'])
-        self.bvpint.setOption('reltol',self.intoptions['bvp_reltol'])
-        self.bvpint.setOption('tf',1)
-        self.bvpint.setOption('disable_internal_warnings', True)
-        self.bvpint.setOption('fsens_err_con', True)
-        self.bvpint.init()
+        self.bvpint = self._integrator('bvp', {
+            'abstol'                    : self.intoptions['bvp_abstol'],
+            'reltol'                    : self.intoptions['bvp_reltol'],
+            'disable_internal_warnings' : True,
+            'fsens_err_con'             : True,
+            }, 1, model=lambda: self.modlT)
 
         # Vector of unknowns [y0, T]
         V = cs.MX.sym("V",self.neq+1)
@@ -298,10 +373,67 @@ class Oscillator(object):
         self.T = sol[-1]
 
 
+    def _batched(self):
+        """
+        SX function evaluating the model and its jacobians at
+        batch_size states at once: inputs the stacked states
+        (batch_size*neq) and p, outputs the stacked dydt
+        (batch_size*neq), dfdy (batch_size*neq, neq) and dfdp
+        (batch_size*neq, np). Built once; any number of states is
+        evaluated in blocks of this size (see _evaluate_batched).
+        """
+        if getattr(self, '_batched_fn', None) is None:
+            n = self.batch_size
+            x = self.model.inputExpr(cs.DAE_X)
+            p = self.model.inputExpr(cs.DAE_P)
+            t = self.model.inputExpr(cs.DAE_T)
+            single = cs.SXFunction([x, p, t], [self.model.outputExpr()[0],
+                                   self.model.jac(cs.DAE_X, 0),
+                                   self.model.jac(cs.DAE_P, 0)])
+            single.init()
+
+            xs = [cs.SX.sym('x%d' % i, self.neq) for i in xrange(n)]
+            ps = cs.SX.sym('p', self.np)
+            ts = cs.SX.sym('t')
+            outs = [single.call([xi, ps, ts]) for xi in xs]
+            fn = cs.SXFunction([cs.vertcat(xs), ps, ts],
+                               [cs.vertcat([out[i] for out in outs])
+                                for i in xrange(3)])
+            fn.init()
+            self._batched_fn = fn
+        return self._batched_fn
+
+    def _evaluate_batched(self, y, p, output):
+        """
+        output 0 (dydt), 1 (dfdy) or 2 (dfdp) at each row of y, in blocks
+        of batch_size rows; the last block is padded with its last row.
+        """
+        y = np.asarray(y, dtype=float)
+        if not len(y):
+            return np.zeros((0, self.neq) + ((), (self.neq,),
+                                             (self.np,))[output])
+        fn = self._batched()
+        n = self.batch_size
+        blocks = []
+        for start in xrange(0, len(y), n):
+            block = y[start:start+n]
+            block = np.vstack([block, np.repeat(block[-1:], n-len(block),
+                                                axis=0)])
+            fn.setInput(block.flatten(), 0)
+            fn.setInput(p, 1)
+            fn.evaluate()
+            out = fn.output(output).toArray().reshape(n, self.neq, -1)
+            blocks.append(out[:min(n, len(y)-start)])
+        out = np.concatenate(blocks)
+        return out if output else out[:, :, 0]
+
     def dydt(self,y):
         """
-        Function to calculate model for given y.
+        Function to calculate model for given y. An array of states,
+        shape (N, neq), is evaluated in one call, returning (N, neq).
         """
+        if np.ndim(y) == 2 and np.shape(y)[1] == self.neq:
+            return self._evaluate_batched(y, self.param, 0)
         try:
             out = []
             for yi in y:
@@ -321,9 +453,13 @@ class Oscillator(object):
 
     def dfdp(self,y,p=None):
         """
-        Function to calculate model jacobian for given y and p.
+        Function to calculate model jacobian for given y and p. An array
+        of states, shape (N, neq), is evaluated in one call, returning
+        (N, neq, np).
         """
         if p is None: p = self.param
+        if np.ndim(y) == 2 and np.shape(y)[1] == self.neq:
+            return self._evaluate_batched(y, p, 2)
 
         try:
             out = []
@@ -344,9 +480,13 @@ class Oscillator(object):
 
     def dfdy(self,y,p=None):
         """
-        Function to calculate model jacobian for given y and p.
+        Function to calculate model jacobian for given y and p. An array
+        of states, shape (N, neq), is evaluated in one call, returning
+        (N, neq, neq).
         """
         if p is None: p = self.param
+        if np.ndim(y) == 2 and np.shape(y)[1] == self.neq:
+            return self._evaluate_batched(y, p, 1)
         try:
             out = []
             for yi in y:
@@ -474,14 +614,11 @@ class Oscillator(object):
 
         self.ts = np.linspace(0, self.T, self.intoptions['lc_res'])
 
-        intlc = cs.Integrator('cvodes',self.model)
-        intlc.setOption("abstol"       , self.intoptions['lc_abstol'])
-        intlc.setOption("reltol"       , self.intoptions['lc_reltol'])
-        intlc.setOption("max_num_steps", self.intoptions['lc_maxnumsteps'])
-        intlc.setOption("tf"           , self.T)
-
-        intsim = cs.Simulator(intlc, self.ts)
-        intsim.init()
+        intsim = self._simulator('limit_cycle', {
+            "abstol"       : self.intoptions['lc_abstol'],
+            "reltol"       : self.intoptions['lc_reltol'],
+            "max_num_steps": self.intoptions['lc_maxnumsteps'],
+            }, self.ts)
 
         # Input Arguments
         intsim.setInput(self.y0, cs.INTEGRATOR_X0)
@@ -492,6 +629,52 @@ class Oscillator(object):
         # create interpolation object
         self.lc = self.interp_sol(self.ts, self.sol.T)
 
+    def cached_limit_cycle(self, cache_dir, trans=500, tout=300):
+        """
+        approx_y0_T(tout, trans=trans) followed by limit_cycle(), with
+        the results (y0, T, the limit cycle samples and the coefficients
+        of its spline) kept in cache_dir. The cache key hashes the model
+        equations, parameters, initial values, integrator options and
+        arguments, so a later call for the same setup, from any script
+        or process, restores the limit cycle without integrating.
+        """
+        key = hashlib.sha1()
+        key.update(str(self.model.outputExpr()[0]))
+        key.update(np.asarray(self.param, dtype=float).tostring())
+        key.update(np.asarray(self.y0, dtype=float).tostring())
+        key.update(repr(sorted(self.intoptions.items())))
+        key.update(repr((trans, tout)))
+        path = os.path.join(cache_dir, 'limit_cycle_%s.p' % key.hexdigest())
+
+        if os.path.exists(path):
+            with open(path, 'rb') as read_file:
+                cached = pickle.load(read_file)
+            self.y0 = cached['y0']
+            self.T = cached['T']
+            self.ts = cached['ts']
+            self.sol = cached['sol']
+            self.lc = jha.MultivariatePeriodicSpline.from_tcks(
+                cached['tcks'], period=self.T)
+            return
+
+        self.approx_y0_T(tout=tout, trans=trans)
+        if self.T <= 0:
+            raise RuntimeError("cached_limit_cycle: no stable period "
+                               "found")
+        self.limit_cycle()
+
+        if not os.path.exists(cache_dir):
+            try: os.makedirs(cache_dir)
+            except OSError: pass
+        # written under a temporary name, then renamed, for concurrent
+        # processes computing the same limit cycle
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as output_file:
+            pickle.dump({'y0': self.y0, 'T': self.T, 'ts': self.ts,
+                         'sol': self.sol, 'tcks': self.lc.tcks()},
+                        output_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)
+
     def interp_sol(self, tin, yin):
         """
         Function to create a periodic spline interpolater
@@ -517,23 +700,13 @@ class Oscillator(object):
         eigenvalues of the monodromy matrix
         """
 
-        integrator = cs.Integrator('cvodes', self.model)
-        integrator.setOption("abstol", self.intoptions['sensabstol'])
-        integrator.setOption("reltol", self.intoptions['sensreltol'])
-        integrator.setOption("max_num_steps", self.intoptions['int_maxstepcount'])
-        integrator.setOption("sensitivity_method",
-                             self.intoptions['sensmethod']);
-        integrator.setOption("t0", 0)
-        integrator.setOption("tf", self.T)
-        integrator.setOption("fsens_err_con", 1)
-        integrator.setOption("fsens_abstol", self.intoptions['sensabstol'])
-        integrator.setOption("fsens_reltol", self.intoptions['sensreltol'])
-        integrator.init()
+        integrator = self._integrator('sensitivity', self._sens_options(
+            self.intoptions['int_maxstepcount']), self.T)
         integrator.setInput(self.y0, cs.INTEGRATOR_X0)
         integrator.setInput(self.param, cs.INTEGRATOR_P)
 
-        intdyfdy0 = integrator.jacobian(cs.INTEGRATOR_X0, cs.INTEGRATOR_XF)
-        intdyfdy0.init()
+        intdyfdy0 = self._jacobian(integrator, cs.INTEGRATOR_X0,
+                                   cs.INTEGRATOR_XF)
         intdyfdy0.setInput(self.y0,"x0")
         intdyfdy0.setInput(self.param,"p")
         intdyfdy0.evaluate()
@@ -562,24 +735,13 @@ class Oscillator(object):
         self.check_monodromy()
         monodromy = self.monodromy
 
-        integrator = cs.Integrator('cvodes',self.model)
-        integrator.setOption("abstol", self.intoptions['sensabstol'])
-        integrator.setOption("reltol", self.intoptions['sensreltol'])
-        integrator.setOption("max_num_steps",
-                             self.intoptions['sensmaxnumsteps'])
-        integrator.setOption("sensitivity_method",
-                             self.intoptions['sensmethod']);
-        integrator.setOption("t0", 0)
-        integrator.setOption("tf", self.T)
-        integrator.setOption("fsens_err_con", 1)
-        integrator.setOption("fsens_abstol", self.intoptions['sensabstol'])
-        integrator.setOption("fsens_reltol", self.intoptions['sensreltol'])
-        integrator.init()
+        integrator = self._integrator('sensitivity', self._sens_options(
+            self.intoptions['sensmaxnumsteps']), self.T)
         integrator.setInput(self.y0,cs.INTEGRATOR_X0)
         integrator.setInput(self.param,cs.INTEGRATOR_P)
 
-        intdyfdp = integrator.jacobian(cs.INTEGRATOR_P, cs.INTEGRATOR_XF)
-        intdyfdp.init()
+        intdyfdp = self._jacobian(integrator, cs.INTEGRATOR_P,
+                                  cs.INTEGRATOR_XF)
         intdyfdp.setInput(self.y0,"x0")
         intdyfdp.setInput(self.param,"p")
         intdyfdp.evaluate()
@@ -617,20 +779,8 @@ class Oscillator(object):
         state_ind = 1
         while np.abs(self.dydt(self.y0)[state_ind]) < 1E-5: state_ind += 1
 
-        integrator = cs.Integrator('cvodes',self.model)
-        integrator.setOption("abstol", self.intoptions['sensabstol'])
-        integrator.setOption("reltol", self.intoptions['sensreltol'])
-        integrator.setOption("max_num_steps",
-                             self.intoptions['sensmaxnumsteps'])
-        integrator.setOption("sensitivity_method",
-                             self.intoptions['sensmethod']);
-        integrator.setOption("t0", 0)
-        integrator.setOption("tf", num_cycles*self.T)
-        #integrator.setOption("numeric_jacobian", True)
-        integrator.setOption("fsens_err_con", 1)
-        integrator.setOption("fsens_abstol", self.intoptions['sensabstol'])
-        integrator.setOption("fsens_reltol", self.intoptions['sensreltol'])
-        integrator.init()
+        integrator = self._integrator('sensitivity', self._sens_options(
+            self.intoptions['sensmaxnumsteps']), num_cycles*self.T)
         seed = np.zeros(self.neq)
         seed[state_ind] = 1.
         integrator.setInput(self.y0, cs.INTEGRATOR_X0)
@@ -638,8 +788,8 @@ class Oscillator(object):
         #adjseed = (seed, cs.INTEGRATOR_XF)
         integrator.evaluate()#0, 1)
 
-        monodromy = integrator.jacobian(cs.INTEGRATOR_X0,cs.INTEGRATOR_XF)
-        monodromy.init()
+        monodromy = self._jacobian(integrator, cs.INTEGRATOR_X0,
+                                   cs.INTEGRATOR_XF)
         monodromy.setInput(self.y0,"x0")
         monodromy.setInput(self.param,"p")
         monodromy.evaluate()
@@ -659,12 +809,11 @@ class Oscillator(object):
 
         self.sPRC = self._t_to_phi(P/self.dydt(self.y0)[state_ind])
 
-        dfdp = np.array([self.dfdp(self.lc(t)) for t in self.prc_ts])
+        dfdp = self.dfdp(self.lc(self.prc_ts))
         # Must rescale f to \hat{f}, inverse of rescaling t
         self.pPRC = self._t_to_phi(
-                        np.array([self.sPRC[i].dot(self._phi_to_t(dfdp[i]))
-                              for i in xrange(len(self.sPRC))])
-                                  )
+                        np.einsum('ij,ijk->ik', self.sPRC,
+                                  self._phi_to_t(dfdp)))
         self.rel_pPRC = self.pPRC*np.array(self.param)
 
         # Create interpolation object for the state phase response curve
@@ -704,6 +853,21 @@ class Oscillator(object):
         return ffcn
 
 
+    def _arc_integrator(self, numstates, trans):
+        """
+        Pooled quadrature integrator of _create_ARC_model(numstates) over
+        trans cycles. The model depends on T and avg, so they are part of
+        the key.
+        """
+        return self._integrator(
+            ('arc', numstates, self.T, tuple(self.avg)), {
+                "abstol"        : self.intoptions['sensabstol'],
+                "reltol"        : self.intoptions['sensreltol'],
+                "max_num_steps" : self.intoptions['sensmaxnumsteps'],
+                "t0"            : 0,
+            }, trans*self.T,
+            model=lambda: self._create_ARC_model(numstates=numstates))
+
     def _sarc_single_time(self, time, seed):
         """ Calculate the state amplitude response to an infinitesimal
         perturbation in the direction of seed, at specified time. """
@@ -737,16 +901,7 @@ class Oscillator(object):
         if not hasattr(self, 'sPRC'): self.find_prc(res)
 
         # Set up quadrature integrator
-        self.sarc_int = cs.Integrator('cvodes',self._create_ARC_model())
-        self.sarc_int.setOption("abstol", self.intoptions['sensabstol'])
-        self.sarc_int.setOption("reltol", self.intoptions['sensreltol'])
-        self.sarc_int.setOption("max_num_steps",
-                             self.intoptions['sensmaxnumsteps'])
-        self.sarc_int.setOption("t0", 0)
-        self.sarc_int.setOption("tf", trans*self.T)
-        #self.sarc_int.setOption("numeric_jacobian", True)
-
-        self.sarc_int.init()
+        self.sarc_int = self._arc_integrator(1, trans)
 
         t_arc = np.linspace(0, self.yT, res)
         arc = np.array([self._sarc_single_time(t, seed) for t, seed in
@@ -776,16 +931,7 @@ class Oscillator(object):
         if not hasattr(self, 'sPRC'): self.find_prc(res)
 
         # Set up quadrature integrator
-        self.sarc_int = cs.Integrator('cvodes',
-            self._create_ARC_model(numstates=self.neq))
-        self.sarc_int.setOption("abstol", self.intoptions['sensabstol'])
-        self.sarc_int.setOption("reltol", self.intoptions['sensreltol'])
-        self.sarc_int.setOption("max_num_steps",
-                             self.intoptions['sensmaxnumsteps'])
-        self.sarc_int.setOption("t0", 0)
-        self.sarc_int.setOption("tf", trans*self.T)
-        #self.sarc_int.setOption("numeric_jacobian", True)
-        self.sarc_int.init()
+        self.sarc_int = self._arc_integrator(self.neq, trans)
 
         self.arc_ts = np.linspace(0, self.T, res)
 
@@ -812,9 +958,9 @@ class Oscillator(object):
 
         #[time, state_out, state_in]
         self.sARC = np.array(amp_change)
-        dfdp = np.array([self.dfdp(self.lc(t)) for t in self.arc_ts])
-        self.pARC = np.array([self.sARC[i].dot(self._phi_to_t(dfdp[i]))
-                              for i in xrange(len(self.sARC))])
+        dfdp = self.dfdp(self.lc(self.arc_ts))
+        self.pARC = np.einsum('ijk,ikl->ijl', self.sARC,
+                              self._phi_to_t(dfdp))
 
         self.rel_pARC = (np.array(self.param) * self.pARC /
                          np.atleast_2d(self.avg).T)
@@ -838,18 +984,17 @@ class Oscillator(object):
         species concentration. outputs to self.avg
         """
 
-        ffcn_in = self.model.inputExpr()
-        ode = self.model.outputExpr()
-        quad = cs.vertcat([ffcn_in[cs.DAE_X], ffcn_in[cs.DAE_X]**2])
-
-        quadmodel = cs.SXFunction(ffcn_in, cs.daeOut(ode=ode[0], quad=quad))
-
-        qint = cs.Integrator('cvodes',quadmodel)
-        qint.setOption("abstol"        , self.intoptions['lc_abstol'])
-        qint.setOption("reltol"        , self.intoptions['lc_reltol'])
-        qint.setOption("max_num_steps" , self.intoptions['lc_maxnumsteps'])
-        qint.setOption("tf",self.T)
-        qint.init()
+        def quadmodel():
+            ffcn_in = self.model.inputExpr()
+            ode = self.model.outputExpr()
+            quad = cs.vertcat([ffcn_in[cs.DAE_X], ffcn_in[cs.DAE_X]**2])
+            return cs.SXFunction(ffcn_in, cs.daeOut(ode=ode[0], quad=quad))
+
+        qint = self._integrator('average', {
+            "abstol"        : self.intoptions['lc_abstol'],
+            "reltol"        : self.intoptions['lc_reltol'],
+            "max_num_steps" : self.intoptions['lc_maxnumsteps'],
+            }, self.T, model=quadmodel)
         qint.setInput(self.y0, cs.INTEGRATOR_X0)
         qint.setInput(self.param, cs.INTEGRATOR_P)
         qint.evaluate()
@@ -863,6 +1008,35 @@ class Oscillator(object):
         (0,2*pi) """
         return self.lc(self._phi_to_t(phi%(2*np.pi)))
 
+    def random_phase_times(self, M, random_state=None, coherence=0.,
+                           mean_phase=0.):
+        """
+        Times on (0, T) of M random phases of the limit cycle. Phases
+        are uniform for coherence 0, as wt_T*rand() for each cell, or
+        von Mises around mean_phase with concentration chosen so that
+        the expected Kuramoto order parameter of the phases is
+        coherence, in [0, 1).
+        """
+        if random_state is None: random_state = np.random.mtrand._rand
+        if coherence == 0:
+            return self.T*random_state.rand(M)
+        # order parameter of the von Mises distribution is I1/I0(kappa)
+        kappa = brentq(lambda k: i1e(k)/i0e(k) - coherence, 0, 1E6)
+        phases = random_state.vonmises(mean_phase, kappa, M)
+        return self._phi_to_t(phases%(2*np.pi))
+
+    def random_phase_states(self, M, random_state=None, coherence=0.,
+                            mean_phase=0., states=None):
+        """
+        States at M random phases of the limit cycle (see
+        random_phase_times) from one evaluation of self.lc, shape
+        (M, neq), or (M, len(states)) keeping only the indices in states.
+        """
+        y = self.lc(self.random_phase_times(M, random_state, coherence,
+                                            mean_phase))
+        if states is not None: y = y[:, states]
+        return y
+
     def phase_of_point(self, point, error=False, tol=1E-3):
         """ Finds the phase at which the distance from the point to the
         limit cycle is minimized. phi=0 corresponds to the definition of
@@ -872,14 +1046,12 @@ class Oscillator(object):
         point = np.asarray(point)
 
         #set up integrator so we only have to once...
-        intr = cs.Integrator('cvodes',self.model)
-        intr.setOption("abstol", self.intoptions['bvp_abstol'])
-        intr.setOption("reltol", self.intoptions['bvp_reltol'])
-        intr.setOption("tf", self.T)
-        intr.setOption("max_num_steps",
-                       self.intoptions['transmaxnumsteps'])
-        intr.setOption("disable_internal_warnings", True)
-        intr.init()
+        intr = self._integrator('phase_of_point', {
+            "abstol"                    : self.intoptions['bvp_abstol'],
+            "reltol"                    : self.intoptions['bvp_reltol'],
+            "max_num_steps"             : self.intoptions['transmaxnumsteps'],
+            "disable_internal_warnings" : True,
+            }, self.T)
         for i in xrange(100):
             dist = cs.SX.sym("dist")
             x = self.model.inputExpr(cs.DAE_X)
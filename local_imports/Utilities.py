@@ -11,7 +11,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from scipy.interpolate import (splrep, splint, fitpack, splev,
                                UnivariateSpline, dfitpack,
-                               InterpolatedUnivariateSpline)
+                               InterpolatedUnivariateSpline, BSpline)
 from matplotlib.colors import LinearSegmentedColormap
 import matplotlib.pyplot as plt
 from ColorMapCreator import ColorMapCreator
@@ -237,18 +237,55 @@ class MultivariatePeriodicSpline(object):
         splinefn = (ComplexPeriodicSpline if self.iscomplex else
                     PeriodicSpline)
 
+        self.T = period
         self.splines = fnlist([])
         for y in np.atleast_2d(ys):
             y = y.squeeze()
             self.splines += [splinefn(x, y, period, sfactor, k)]
+        self._stack()
+
+    def _stack(self):
+        """ One BSpline with the coefficients of every spline stacked,
+        when they share their knots (always so for sfactor=0). """
+        self._bspline = None
+        if self.iscomplex: return
+        t, c, k = self.splines[0]._eval_args
+        if all(np.array_equal(interp._eval_args[0], t) and
+               interp._eval_args[2] == k for interp in self.splines):
+            n = len(t) - k - 1
+            coefficients = np.array([interp._eval_args[1][:n]
+                                     for interp in self.splines]).T
+            self._bspline = BSpline(t, coefficients, k)
 
     def __call__(self, x, d=0):
-        return self.splines(x, d).T
+        if self._bspline is None:
+            return self.splines(x, d).T
+        # all states at once, in the layout of self.splines(x, d).T
+        values = self._bspline(np.asarray(x) % self.T, nu=d)
+        return np.rollaxis(values, -1).T
 
     def integrate(self, a=0, b=2*np.pi):
         return np.array([interp.integrate(a,b) for interp in
                          self.splines])
 
+    def tcks(self):
+        """ (t, c, k) of each spline, to rebuild it with from_tcks """
+        if self.iscomplex:
+            raise NotImplementedError('tcks unsupported for complex '
+                                      'splines')
+        return [interp._eval_args for interp in self.splines]
+
+    @classmethod
+    def from_tcks(cls, tcks, period=2*np.pi):
+        """ Construct the spline from the (t, c, k) of each dimension """
+        self = cls.__new__(cls)
+        self.iscomplex = False
+        self.T = period
+        self.splines = fnlist([PeriodicSpline._from_tck(tck, period)
+                               for tck in tcks])
+        self._stack()
+        return self
+
 def p_integrate(x, y, meth='spline'):
     """ Integrate y(x), assuming x in (0, 2*pi). x and y should contain
     the last point (x[-1] = 2*pi, y[-1] = y[0]). y[i,j,k] can be
@@ -0,0 +1,284 @@
+"""
+Runs the stochastic simulation sweeps on a pool of worker processes.
+
+A sweep is split into (level, replicate, genotype) tasks, where a level is
+one model configuration (a kav, or an AVP/VIP cell count). With batch
+set, a task is instead a (level, genotype), whose replicates are
+simulated together by an ensemble solver. Workers compile
+the model of a level once, through a compile_model function of one of the
+model modules, and re-run it for each task. Each finished task is written
+to its own pickle as it completes, so a sweep streams to disk instead of
+holding all trajectories in memory; once a level is complete its tasks
+are assembled into the per-genotype pickles read by
+perform_mic_calculation.py (a list with one model.run() result per
+replicate).
+
+The task pickles double as a checkpoint of the sweep: run() skips levels
+whose pickles are assembled and tasks whose pickles exist, so an
+interrupted sweep is restarted by running it again. Since every task
+draws from its own seed, the result is identical to an uninterrupted
+run. With checkpoint_interval set, each trajectory in progress is also
+snapshotted (see stoch_engine.Checkpoint), so that long trajectories
+resume where they stopped.
+
+John Abel
+"""
+
+from __future__ import division
+import os
+import pickle
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from stoch_engine import Checkpoint, ensemble_solvers
+
+# (name, bmalko) of the genotypes simulated for every replicate
+genotypes = [('wt', 'None'), ('avp', 'AVP'), ('vip', 'VIP')]
+
+# compiled models of the current worker, by (compile_model, args)
+_compiled = {}
+
+
+def _run_task(task):
+    """
+    Simulates one (level, replicate, genotype) task in a worker and
+    writes the result. Returns the task key.
+    """
+    (compile_model, model_args, key, bmalko, initial_values, run_options,
+     path) = task
+
+    trajectories = _compiled_model(compile_model, model_args).run(
+        initial_values, bmalko=bmalko, **run_options)
+
+    _dump(trajectories, path, pickle.HIGHEST_PROTOCOL)
+    if run_options.get('checkpoint') is not None:
+        run_options['checkpoint'].clear()
+    return key
+
+
+def _run_batch(task):
+    """
+    Simulates all replicates of a (level, genotype) task in one
+    vectorized pass (CompiledSCNModel.run_ensemble) and writes one pickle
+    per replicate, in the format of _run_task. Returns the task key.
+    """
+    (compile_model, model_args, key, bmalko, initial_values, run_options,
+     paths) = task
+
+    compiled = _compiled_model(compile_model, model_args)
+    options = dict(run_options)
+    options.pop('show_labels', None)
+    values = compiled.run_ensemble(initial_values, bmalko=bmalko, **options)
+
+    tspan = compiled.tspan[::options.get('stride', 1)][:, None]
+    for replicate, path in enumerate(paths):
+        _dump([np.hstack([tspan, values[replicate]])], path,
+              pickle.HIGHEST_PROTOCOL)
+    return key
+
+
+def _compiled_model(compile_model, model_args):
+    """ the compiled model of the current worker, compiled on first use """
+    model_key = (compile_model.__module__, compile_model.__name__,
+                 pickle.dumps(model_args))
+    if model_key not in _compiled:
+        _compiled.clear()
+        _compiled[model_key] = compile_model(*model_args)
+    return _compiled[model_key]
+
+
+def _dump(obj, path, protocol=0):
+    """ write then rename, so a file is either complete or missing """
+    with open(path+'.tmp', 'wb') as output_file:
+        pickle.dump(obj, output_file, protocol)
+    os.rename(path+'.tmp', path)
+
+
+class EnsembleRunner(object):
+    """
+    Simulates (level, replicate, genotype) tasks in parallel.
+    """
+
+    def __init__(self, compile_model, model_args, task_directory,
+                 output_path, processes=None, genotypes=genotypes,
+                 seeds=None, common_random_numbers=False,
+                 checkpoint_interval=None, batch=False, **run_options):
+        """
+        ----
+        compile_model : function
+            module-level function returning a CompiledSCNModel, e.g.
+            stoch_multi_params.compile_model.
+        model_args : function
+            model_args(level) gives the arguments of compile_model.
+        task_directory : str
+            directory for the per-task pickles.
+        output_path : function
+            output_path(name, level) gives the assembled pickle of a
+            genotype, e.g. "data/params/wt_0.1.pickle".
+        processes : optional int
+            number of worker processes, default all cores.
+        seeds : optional seeding.SeedTree
+            if given, task (level, replicate, name) is simulated with the
+            stream of seeds.child(level, replicate, name), which makes the
+            sweep reproducible regardless of the number of workers.
+        common_random_numbers : bool
+            if True, the genotypes of a replicate share the stream of
+            seeds.child(level, replicate, 'crn'). Use with solver='mnrm',
+            which then couples their noise channel by channel.
+        checkpoint_interval : optional float
+            if given, each trajectory in progress is snapshotted every
+            checkpoint_interval seconds, next to its task pickle. Requires
+            solver='direct', 'mnrm' or 'jit'.
+        batch : bool
+            if True, the replicates of a (level, genotype) are one task,
+            simulated together by CompiledSCNModel.run_ensemble with
+            solver 'direct' or 'cle' and the stream of
+            seeds.child(level, name). Results are still identical for any
+            number of workers, but differ from those of serial runs.
+            Common random numbers, checkpoints, labels and reducers are
+            not available.
+        run_options :
+            passed to CompiledSCNModel.run, e.g. show_labels=False, seed=0.
+        """
+        self.compile_model = compile_model
+        self.model_args = model_args
+        self.task_directory = task_directory
+        self.output_path = output_path
+        self.processes = processes if processes is not None else cpu_count()
+        self.genotypes = genotypes
+        self.seeds = seeds
+        self.common_random_numbers = common_random_numbers
+        self.checkpoint_interval = checkpoint_interval
+        self.batch = batch
+        self.run_options = run_options
+        if (checkpoint_interval is not None and
+                run_options.get('solver', 'stochkit') not in
+                ('direct', 'mnrm', 'jit')):
+            raise ValueError("checkpoint_interval needs solver 'direct', "
+                             "'mnrm' or 'jit'.")
+        if batch:
+            if run_options.get('solver', 'direct') not in ensemble_solvers:
+                raise ValueError("batch runs need an ensemble solver, one "
+                                 "of %s." % sorted(ensemble_solvers))
+            if (common_random_numbers or checkpoint_interval is not None
+                    or run_options.get('show_labels')
+                    or run_options.get('reducers')):
+                raise ValueError("batch runs take no common random "
+                                 "numbers, checkpoints, labels or "
+                                 "reducers.")
+
+    def task_path(self, level, replicate, name):
+        """ pickle of one finished task """
+        return os.path.join(self.task_directory,
+                            '%s_%s_%d.pickle' % (name, level, replicate))
+
+    def tasks(self, levels, initial_values):
+        """
+        Tasks of the sweep, ordered by level. initial_values[level] lists
+        the initial values of each replicate, shared by the genotypes.
+        """
+        if self.batch:
+            return self.batch_tasks(levels, initial_values)
+        tasks = []
+        for level in levels:
+            for replicate, y0 in enumerate(initial_values[level]):
+                for name, bmalko in self.genotypes:
+                    options = self.run_options
+                    if self.seeds is not None:
+                        stream = ('crn' if self.common_random_numbers
+                                  else name)
+                        options = dict(options, seed=self.seeds.child(
+                            level, replicate, stream))
+                    path = self.task_path(level, replicate, name)
+                    if self.checkpoint_interval is not None:
+                        options = dict(options, checkpoint=Checkpoint(
+                            path+'.state', self.checkpoint_interval))
+                    tasks.append((self.compile_model, self.model_args(level),
+                                  (level, replicate, name), bmalko,
+                                  np.asarray(y0), options, path))
+        return tasks
+
+    def batch_tasks(self, levels, initial_values):
+        """ (level, genotype) tasks of the sweep, for batch runs """
+        tasks = []
+        for level in levels:
+            replicates = len(initial_values[level])
+            for name, bmalko in self.genotypes:
+                options = self.run_options
+                if self.seeds is not None:
+                    options = dict(options, seed=self.seeds.child(level,
+                                                                  name))
+                paths = [self.task_path(level, replicate, name)
+                         for replicate in range(replicates)]
+                tasks.append((self.compile_model, self.model_args(level),
+                              (level, name), bmalko,
+                              np.asarray(initial_values[level]), options,
+                              paths))
+        return tasks
+
+    def finished(self, task):
+        """ True if the pickles of a task are written """
+        if self.batch:
+            return all(os.path.exists(path) for path in task[-1])
+        return os.path.exists(task[-1])
+
+    def assembled(self, level):
+        """ True if the per-genotype pickles of level are written """
+        return all(os.path.exists(self.output_path(name, level))
+                   for name, bmalko in self.genotypes)
+
+    def assemble(self, level, replicates):
+        """
+        Collects the tasks of a level into one pickle per genotype, then
+        removes the task pickles once all genotypes are written.
+        """
+        paths = []
+        for name, bmalko in self.genotypes:
+            genotype_paths = [self.task_path(level, replicate, name)
+                              for replicate in range(replicates)]
+            trajectories = []
+            for path in genotype_paths:
+                with open(path, 'rb') as read_file:
+                    trajectories.append(pickle.load(read_file))
+            _dump(trajectories, self.output_path(name, level))
+            paths.extend(genotype_paths)
+        for path in paths:
+            os.remove(path)
+
+    def run(self, levels, initial_values):
+        """
+        Runs the sweep. Tasks go to the workers in level order, and each
+        level is assembled as soon as all its tasks are done. Levels and
+        tasks finished by an earlier, interrupted run are skipped.
+        """
+        if not os.path.isdir(self.task_directory):
+            os.makedirs(self.task_directory)
+        levels = [level for level in levels if not self.assembled(level)]
+        all_tasks = self.tasks(levels, initial_values)
+        tasks = [task for task in all_tasks if not self.finished(task)]
+        remaining = dict((level, 0) for level in levels)
+        for task in tasks:
+            remaining[task[2][0]] += 1
+        for level in levels:
+            if remaining[level] == 0:
+                self.assemble(level, len(initial_values[level]))
+        if len(tasks) < len(all_tasks):
+            print "Resuming, "+str(len(tasks))+" tasks to run."
+
+        worker = _run_batch if self.batch else _run_task
+        pool = Pool(self.processes)
+        try:
+            for done, key in enumerate(pool.imap_unordered(worker, tasks)):
+                level = key[0]
+                remaining[level] -= 1
+                if remaining[level] == 0:
+                    self.assemble(level, len(initial_values[level]))
+                    print "Level "+str(level)+" complete, "+\
+                          str(done+1)+"/"+str(len(tasks))+" tasks."
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
@@ -0,0 +1,163 @@
+"""
+Created on 18 Oct 2018
+
+@author: John H. Abel
+
+Deterministic many-cell version of the model from Gonze 2005, the ODE
+counterpart of the stochastic SCN models. The equations are generated
+from the same SCNStructure (scn_model.py), so cell types, kav weighting,
+Bmal1 knockouts and coupling graphs match the stochastic models exactly:
+each ODE is the sum of the propensities of the reactions changing that
+state, at volume 1 (concentrations).
+
+The model is a CasADi SX function in the format of gonze_model.ODEmodel.
+Every cell only reads its own states and its coupling input, so the
+Jacobian is sparse, and replicates from different initial conditions
+can be stacked into one system, integrated together by CVODES with a
+sparse linear solver:
+
+    model = MulticellODEmodel(20, 20, 20, kav=5, replicates=100)
+    sol = integrate_replicates(model, y0s, tspan)
+
+This is a cheap deterministic screen of a sweep point before running
+the stochastic simulations.
+"""
+
+# common imports
+from __future__ import division
+
+# python packages
+import numpy as np
+import casadi as cs
+
+from propensities import functions, slot_name, value_name
+from scn_model import param, pnames, scn_structure
+
+modelversion = 'gonze_model_multicell'
+
+
+def multicell_rhs(structure, x, p, bmalko='None'):
+    """
+    Right-hand side of the ODEs of structure, for the list of states x
+    (concentrations, in the order of structure.species) and the list of
+    parameters p (in the order of pnames). x and p may hold numbers or
+    CasADi SX elements. Returns a list, one entry per state.
+    """
+    namespace = dict(functions)
+    namespace.update(zip(pnames, p))
+    namespace['vol'] = 1.
+
+    # aggregates are the weighted sums of species read by the coupling
+    weights = structure.aggregate_weights.tocsr()
+    state = list(x)
+    for row in range(weights.shape[0]):
+        members = slice(weights.indptr[row], weights.indptr[row+1])
+        state.append(sum([x[i] if w == 1 else w*x[i] for i, w in
+                          zip(weights.indices[members],
+                              weights.data[members])], 0.))
+
+    scale = structure.reaction_scale(bmalko)
+    rates = [None]*structure.n_reactions
+    for template, reactions, index, values in structure.templates:
+        n_values = 0 if values is None else values.shape[1]
+        args = ([slot_name(k) for k in range(index.shape[1])] +
+                [value_name(k) for k in range(n_values)])
+        fn = eval('lambda ' + ', '.join(args) + ': ' + template, namespace)
+        for m, rxn in enumerate(reactions):
+            member = [state[si] for si in index[m]]
+            if n_values:
+                member += list(values[m])
+            rates[rxn] = fn(*member)
+            if scale[rxn] != 1:
+                rates[rxn] = scale[rxn]*rates[rxn]
+
+    changes = structure.stoichiometry.T.tocsr()
+    ode = []
+    for si in range(structure.n_species):
+        members = slice(changes.indptr[si], changes.indptr[si+1])
+        ode.append(sum([rates[rxn] if change > 0 else -rates[rxn]
+                        for rxn, change in zip(changes.indices[members],
+                                               changes.data[members])], 0.))
+    return ode
+
+
+def MulticellODEmodel(AVPcells, VIPcells, NAVcells, kav, bmalko='None',
+                      replicates=1, coupling=None, parameter_values=param):
+    """
+    CasADi SX function of the many-cell ODEs, with replicates independent
+    copies of the population stacked in the state vector.
+    parameter_values only sets the coupling structure, the parameters
+    themselves are inputs of the function as in gonze_model.ODEmodel.
+    """
+    structure = scn_structure(AVPcells, VIPcells, NAVcells, kav,
+                              parameter_values=parameter_values,
+                              coupling=coupling)
+    neq = structure.n_species
+
+    param_set = cs.vertcat([cs.SX.sym(name) for name in pnames])
+    p = [param_set[i] for i in range(len(pnames))]
+
+    # one replicate, then inlined once per replicate
+    x1 = cs.SX.sym('x', neq)
+    t = cs.SX.sym('t')
+    single = cs.SXFunction(cs.daeIn(t=t, x=x1, p=param_set),
+                           cs.daeOut(ode=cs.vertcat(multicell_rhs(
+                               structure, [x1[i] for i in range(neq)], p,
+                               bmalko))))
+    single.init()
+
+    state_set = cs.SX.sym('x', neq*replicates)
+    ode = [single.call(cs.daeIn(t=t, x=state_set[r*neq:(r+1)*neq],
+                                p=param_set))[0]
+           for r in range(replicates)]
+
+    fn = cs.SXFunction(cs.daeIn(t=t, x=state_set, p=param_set),
+                       cs.daeOut(ode=cs.vertcat(ode)))
+    fn.setOption("name", modelversion)
+    return fn
+
+
+def initial_values(AVPcells, VIPcells, NAVcells, kav, y0, bmalko='None',
+                   coupling=None, parameter_values=param):
+    """
+    Initial concentrations of the replicates of MulticellODEmodel, shape
+    (replicates, n_states), from y0 of the same shape as for the
+    stochastic models: a knockout scales the initial A/V of the affected
+    cells.
+    """
+    structure = scn_structure(AVPcells, VIPcells, NAVcells, kav,
+                              parameter_values=parameter_values,
+                              coupling=coupling)
+    y0 = np.atleast_2d(y0)
+    return structure.initial_scale(bmalko)*y0
+
+
+def integrate_replicates(model, y0, tspan, parameter_values=param,
+                         abstol=1E-8, reltol=1E-8, max_num_steps=40000):
+    """
+    Integrates MulticellODEmodel from initial values y0, shape
+    (replicates, n_states) (see initial_values), with CVODES and a
+    sparse direct linear solver.
+    Returns the states at each time of tspan, shape
+    (replicates, len(tspan), n_states).
+    """
+    model.init()
+    integrator = cs.Integrator('cvodes', model)
+    integrator.setOption("abstol", abstol)
+    integrator.setOption("reltol", reltol)
+    integrator.setOption("max_num_steps", max_num_steps)
+    integrator.setOption("tf", tspan[-1])
+    integrator.setOption("t0", tspan[0])
+    integrator.setOption("linear_solver_type", "user_defined")
+    integrator.setOption("linear_solver", "csparse")
+    integrator.init()
+
+    simulator = cs.Simulator(integrator, list(tspan))
+    simulator.init()
+    y0 = np.atleast_2d(y0)
+    simulator.setInput(y0.ravel(), cs.INTEGRATOR_X0)
+    simulator.setInput(parameter_values, cs.INTEGRATOR_P)
+    simulator.evaluate()
+
+    sol = simulator.output().toArray().T
+    return sol.reshape((len(tspan),) + y0.shape).transpose(1, 0, 2)
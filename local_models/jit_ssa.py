@@ -0,0 +1,198 @@
+"""
+JIT-compiled direct method for ReactionNetworks, solver='jit'.
+
+The NumPy solvers of stoch_engine pay interpreter overhead on every
+event. Here the propensities of a network are generated as Python source
+from its propensity templates (one branch per template, parameters
+folded in), and compiled together with a direct-method loop by numba.
+The loop keeps the propensities in a binary sum tree, so that choosing
+the next reaction and updating the propensities changed by a firing
+(from the dependency graph) are O(log n_reactions), and never
+re-evaluates the full propensity vector.
+
+numba is optional. Without it, solver='jit' warns and runs the NumPy
+direct method instead. The kernel draws from numba's own generator,
+seeded from random_state, so its trajectories differ from those of
+solver='direct' for the same seed, but are reproducible.
+
+John Abel
+"""
+
+from __future__ import division
+import math
+import re
+import warnings
+
+import numpy as np
+
+from propensities import fold_constants, slot_name, value_name
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# functions allowed in propensity expressions, for the generated source
+_jit_functions = {'exp': math.exp, 'log': math.log, 'sqrt': math.sqrt,
+                  'pow': math.pow, 'abs': abs}
+
+_kernel_source = '''
+def kernel(x, t, t_end, seed, S_ptr, S_idx, S_val, D_ptr, D_idx,
+           group, slots, consts, scale):
+    np.random.seed(seed)
+    n_reactions = len(group)
+    P = 1
+    while P < n_reactions:
+        P *= 2
+    tree = np.zeros(2*P)
+    for r in range(n_reactions):
+        tree[P+r] = propensity(x, r, group, slots, consts, scale)
+    for i in range(P-1, 0, -1):
+        tree[i] = tree[2*i] + tree[2*i+1]
+
+    events = 0
+    while True:
+        a0 = tree[1]
+        if a0 <= 0:
+            # nothing can fire, state is constant from here on
+            break
+        t += -math.log(1. - np.random.random())/a0
+        if t >= t_end:
+            break
+
+        # descend the sum tree; redraw on a zero leaf from rounding
+        j = -1
+        while j < 0:
+            target = np.random.random()*a0
+            i = 1
+            while i < P:
+                if target < tree[2*i]:
+                    i = 2*i
+                else:
+                    target -= tree[2*i]
+                    i = 2*i + 1
+            if i - P < n_reactions and tree[i] > 0:
+                j = i - P
+
+        for e in range(S_ptr[j], S_ptr[j+1]):
+            x[S_idx[e]] += S_val[e]
+        for e in range(D_ptr[j], D_ptr[j+1]):
+            r = D_idx[e]
+            i = P + r
+            tree[i] = propensity(x, r, group, slots, consts, scale)
+            i //= 2
+            while i >= 1:
+                tree[i] = tree[2*i] + tree[2*i+1]
+                i //= 2
+        events += 1
+    return events
+'''
+
+
+def _propensity_source(groups):
+    """
+    Source of propensity(x, r, group, slots, consts, scale), the
+    propensity of reaction r, with one branch per template.
+    """
+    lines = ['def propensity(x, r, group, slots, consts, scale):',
+             '    g = group[r]']
+    for gi, g in enumerate(groups):
+        names = ([slot_name(k) for k in range(g.n_slots)] +
+                 [value_name(k) for k in range(g.n_values)])
+        expression = fold_constants(g.template, names, g.constants)
+        expression = re.sub(r'\b_s(\d+)\b', r'x[slots[r, \1]]', expression)
+        expression = re.sub(r'\b_c(\d+)\b', r'consts[r, \1]', expression)
+        lines += ['    if g == %d:' % gi,
+                  '        return scale[r]*(%s)' % expression]
+    lines.append('    return 0.')
+    return '\n'.join(lines) + '\n'
+
+
+def compile_kernel(network, jit=True):
+    """
+    Generates the kernel of network, compiled by numba if jit is True and
+    numba is installed. Returns (kernel, arrays): kernel(x, t, t_end,
+    seed, *arrays) advances the solver state x in place from time t to
+    t_end and returns the number of events. The kernel is cached for the
+    network and its scaled copies; the scale of each reaction is the
+    last entry of arrays.
+    """
+    propensities = network.propensities
+    groups = propensities.groups
+    key = ('jit_kernel', jit)
+    if key not in network._cache:
+        namespace = dict(_jit_functions, np=np, math=math)
+        exec(_propensity_source(groups) + _kernel_source, namespace)
+        kernel = namespace['kernel']
+        if jit and numba is not None:
+            namespace['propensity'] = numba.njit(namespace['propensity'])
+            kernel = numba.njit(kernel)
+
+        n_slots = max([1] + [g.n_slots for g in groups])
+        n_values = max([1] + [g.n_values for g in groups])
+        slots = np.zeros((network.n_reactions, n_slots), dtype=np.int64)
+        consts = np.zeros((network.n_reactions, n_values))
+        for g in groups:
+            slots[g.reactions, :g.n_slots] = g.index
+            consts[g.reactions, :g.n_values] = g.values
+        S = network.stoichiometry
+        D = network.dependency_graph()
+        network._cache[key] = (kernel, (
+            S.indptr.astype(np.int64), S.indices.astype(np.int64),
+            S.data.astype(float), D.indptr.astype(np.int64),
+            D.indices.astype(np.int64), propensities.group_of.astype(
+                np.int64), slots, consts))
+
+    kernel, arrays = network._cache[key]
+    scale = np.empty(network.n_reactions)
+    for g in groups:
+        scale[g.reactions] = g.scale
+    return kernel, arrays + (scale,)
+
+
+def ssa_jit(network, x0, tspan, random_state, recorder=None,
+            checkpoint=None):
+    """
+    Direct method through the JIT-compiled kernel. Returns the species
+    counts at each time in tspan, or the values kept by recorder, as
+    stoch_engine.ssa_direct, which it falls back to without numba.
+
+    The kernel runs from one output time to the next, and the state is
+    handed to the recorder in between, so observables, reducers (and
+    their early stop) and checkpoints work as for ssa_direct. Each call
+    rebuilds the sum tree, O(n_reactions) per output time, and draws a
+    new kernel seed from random_state; the pending firing time is
+    dropped at each output time, which is exact since it is exponential.
+    """
+    from stoch_engine import Recorder, ssa_direct
+    if numba is None:
+        warnings.warn("numba is not installed; solver 'jit' runs the "
+                      "NumPy direct method instead.")
+        return ssa_direct(network, x0, tspan, random_state, recorder,
+                          checkpoint)
+
+    kernel, arrays = compile_kernel(network)
+    tspan = np.asarray(tspan, dtype=float)
+    x = network.initial_state(x0)
+    nt = len(tspan)
+    if recorder is None: recorder = Recorder(network, nt)
+    t = tspan[0]
+    k = 0
+    if checkpoint is not None:
+        checkpoint.start()
+        saved = checkpoint.load()
+        if saved is not None:
+            x, t, k, rng_state, recorder_state = saved
+            random_state.set_state(rng_state)
+            recorder.set_state(recorder_state)
+    while k < nt:
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save((x, t, k, random_state.get_state(),
+                             recorder.get_state()))
+        if tspan[k] > t:
+            kernel(x, t, tspan[k], random_state.randint(2**31), *arrays)
+            t = tspan[k]
+        recorder.record(k, x)
+        k += 1
+    return recorder.result()
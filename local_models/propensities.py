@@ -0,0 +1,303 @@
+"""
+Compiles gillespy propensity strings into vectorized NumPy kernels.
+
+The many-cell models repeat the same propensity for every cell, e.g.
+'vol*v2*(X1'+ci+'/vol)/(K2+X1'+ci+'/vol)'. Each expression is parsed
+once into a template, in which species are replaced by numbered slots
+and leading numerical factors (the bmalko '0.05*') are split off as a
+per-reaction scale. Reactions sharing a template form a PropensityGroup
+that is evaluated as one array operation over the state vector.
+
+Parenthesized sums of species, such as the AVP and VIP sums inside
+coupling_str, are replaced by aggregates: extra state entries holding the
+running total, which the solvers update along with the species whenever
+a member species changes. Coupling propensities then read one cached
+value instead of re-summing ~80 species.
+
+Templates may also read per-member constants _c0, _c1, ..., e.g. the
+normalization of the coupling input of each cell of a sparse coupling
+graph, so that members differing only in a constant share one template.
+
+John Abel
+"""
+
+from __future__ import division
+import re
+from copy import copy
+
+import numpy as np
+from scipy import sparse
+
+
+# tokens of a propensity expression: numbers first, so that the exponent
+# of 1e-3 is not read as a name
+_token_re = re.compile(r'(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)'
+                       r'|([A-Za-z_]\w*)')
+
+# leading numerical factor, e.g. the '0.05*' of a Bmal1 knockout
+_factor_re = re.compile(r'^(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)'
+                        r'\*')
+
+# parenthesized sum of names, e.g. (0+A10+A11+A12); not a function call
+_sum_re = re.compile(r'(?<!\w)\((?:0\+)?([A-Za-z_]\w*(?:\+[A-Za-z_]\w*)+)\)')
+
+# functions allowed to appear in propensity expressions
+functions = {'exp': np.exp, 'log': np.log, 'sqrt': np.sqrt,
+             'pow': np.power, 'abs': np.abs}
+
+
+def slot_name(k):
+    """ Name of the k-th species slot of a template. """
+    return '_s%d' % k
+
+
+def value_name(k):
+    """ Name of the k-th per-member constant of a template. """
+    return '_c%d' % k
+
+
+def aggregate_name(k):
+    """ Name of the k-th aggregate (running sum of species). """
+    return '_agg%d' % k
+
+
+def parse_template(expression, species_index, aggregates=None):
+    """
+    Splits a propensity expression into (template, species, scale), where
+    template is the expression with species replaced by slots _s0, _s1,
+    ... in order of first appearance, species lists the state index of
+    each slot, and scale is the product of leading numerical factors.
+
+    If aggregates is a list, sums of species are replaced by aggregates.
+    Each aggregate is a sorted tuple of the summed species indices,
+    appended to aggregates when first seen; the k-th aggregate has state
+    index len(species_index)+k.
+    """
+    expr = re.sub(r'\s+', '', expression)
+    state_index = species_index
+
+    if aggregates is not None:
+        state_index = dict(species_index)
+        for k, members in enumerate(aggregates):
+            state_index[aggregate_name(k)] = len(species_index) + k
+
+        def replace_sum(match):
+            names = match.group(1).split('+')
+            if not all(name in species_index for name in names):
+                return match.group(0)
+            members = tuple(sorted(species_index[name] for name in names))
+            if members not in aggregates:
+                aggregates.append(members)
+                k = len(aggregates) - 1
+                state_index[aggregate_name(k)] = len(species_index) + k
+            return aggregate_name(aggregates.index(members))
+
+        expr = _sum_re.sub(replace_sum, expr)
+
+    scale = 1.
+    match = _factor_re.match(expr)
+    while match is not None:
+        scale *= float(match.group(1))
+        expr = expr[match.end():]
+        match = _factor_re.match(expr)
+
+    species = []
+    def replace(match):
+        number, name = match.groups()
+        if name is None or name not in state_index:
+            return match.group(0)
+        idx = state_index[name]
+        if idx not in species:
+            species.append(idx)
+        return slot_name(species.index(idx))
+
+    template = _token_re.sub(replace, expr)
+    return template, species, scale
+
+
+def fold_constants(template, names, constants):
+    """
+    Expression of a template with the parameters replaced by their
+    values. names (the slots) and functions are kept.
+    """
+    def replace(match):
+        number, name = match.groups()
+        if number is not None or name in names or name in functions:
+            return match.group(0)
+        if name in constants:
+            return repr(float(constants[name]))
+        raise ValueError("Unknown name '%s' in propensity '%s'."
+                         % (name, template))
+
+    return _token_re.sub(replace, template)
+
+
+def compile_template(template, n_slots, constants, n_values=0):
+    """
+    Compiles a template into a function of its slot values, followed by
+    its n_values per-member constants, with the parameters folded in as
+    constants. Arguments may be arrays, in which case the template is
+    evaluated elementwise.
+    """
+    slots = ([slot_name(k) for k in range(n_slots)] +
+             [value_name(k) for k in range(n_values)])
+    source = ('lambda ' + ', '.join(slots) + ': ' +
+              fold_constants(template, slots, constants))
+    return eval(compile(source, '<propensity>', 'eval'), dict(functions))
+
+
+class PropensityGroup(object):
+    """
+    Reactions that share one propensity template.
+    """
+
+    def __init__(self, template, reactions, index, scale, constants,
+                 values=None):
+        """
+        ----
+        template : str
+            propensity expression in slots _s0, _s1, ... and parameters.
+        reactions : iterable of int
+            reaction indices of the group members.
+        index : array-like, shape (n_members, n_slots)
+            state index bound to each slot, for each member.
+        scale : iterable of float
+            factor multiplying the propensity of each member.
+        constants : dict
+            parameter values, including 'vol'.
+        values : optional array-like, shape (n_members, n_values)
+            per-member constants bound to _c0, _c1, ...
+        """
+        self.template = template
+        self.reactions = np.asarray(reactions, dtype=int)
+        self.index = np.asarray(index, dtype=int)
+        if self.index.size == 0:
+            self.index = np.zeros((len(self.reactions), 0), dtype=int)
+        self.n_slots = self.index.shape[1]
+        self.scale = np.asarray(scale, dtype=float)
+        if values is None:
+            values = np.zeros((len(self.reactions), 0))
+        self.values = np.asarray(values, dtype=float)
+        self.n_values = self.values.shape[1]
+        self.constants = constants
+        self.fn = compile_template(template, self.n_slots, constants,
+                                   self.n_values)
+
+    def __call__(self, x):
+        """ Propensities of all members, shape x.shape[:-1]+(n_members,) """
+        values = self.fn(*([x[..., self.index[:, k]]
+                            for k in range(self.n_slots)] +
+                           [self.values[:, k] for k in range(self.n_values)]))
+        return self.scale*values
+
+    def subset(self, x, members):
+        """ Propensities of the given members only, for state vector x. """
+        index = self.index[members]
+        values = self.fn(*([x[index[:, k]] for k in range(self.n_slots)] +
+                           [self.values[members, k]
+                            for k in range(self.n_values)]))
+        return self.scale[members]*values
+
+    def with_scale(self, scale):
+        """ Copy of the group with new member scales, sharing the kernel. """
+        group = copy(self)
+        group.scale = np.asarray(scale, dtype=float)
+        return group
+
+
+class CompiledPropensities(object):
+    """
+    All propensities of a network as a list of PropensityGroups. Calling
+    the object with a state vector x (or a stack of them, shape
+    (..., n_state)) returns the propensities, shape x.shape[:-1]+(n_rxns,).
+    """
+
+    def __init__(self, groups, n_reactions):
+        self.groups = list(groups)
+        self.n_reactions = n_reactions
+
+        # group and position within the group of each reaction
+        self.group_of = np.empty(n_reactions, dtype=int)
+        self.member_of = np.empty(n_reactions, dtype=int)
+        for gi, group in enumerate(self.groups):
+            self.group_of[group.reactions] = gi
+            self.member_of[group.reactions] = np.arange(len(group.reactions))
+
+    @classmethod
+    def from_expressions(cls, expressions, species_index, constants,
+                         aggregates=None):
+        """
+        Parses gillespy propensity strings and groups the reactions that
+        share a template. Pass a list as aggregates to collect sums of
+        species as aggregates (see parse_template).
+        """
+        members = {}
+        order = []
+        for ri, expression in enumerate(expressions):
+            template, species, scale = parse_template(
+                expression, species_index, aggregates)
+            if template not in members:
+                members[template] = []
+                order.append(template)
+            members[template].append((ri, species, scale))
+
+        groups = []
+        for template in order:
+            reactions, index, scale = zip(*members[template])
+            groups.append(PropensityGroup(template, reactions, list(index),
+                                          scale, constants))
+        return cls(groups, len(expressions))
+
+    def with_scale(self, scale):
+        """ Copy with the scale factor of reaction r set to scale[r]. """
+        scale = np.asarray(scale, dtype=float)
+        return type(self)([g.with_scale(scale[g.reactions])
+                           for g in self.groups], self.n_reactions)
+
+    def reads(self, n_state):
+        """
+        Sparse boolean matrix, shape (n_reactions, n_state), marking the
+        state entries each propensity depends on.
+        """
+        rows = np.hstack([np.repeat(g.reactions, g.n_slots)
+                          for g in self.groups])
+        cols = np.hstack([g.index.ravel() for g in self.groups])
+        return sparse.csr_matrix((np.ones(len(rows), dtype=bool),
+                                  (rows, cols)),
+                                 shape=(self.n_reactions, n_state))
+
+    def single(self, x, r):
+        """ Propensity of reaction r alone, for state vector x. """
+        group = self.groups[self.group_of[r]]
+        m = self.member_of[r]
+        if group.n_values:
+            return group.scale[m]*group.fn(*(list(x[group.index[m]]) +
+                                             list(group.values[m])))
+        return group.scale[m]*group.fn(*x[group.index[m]])
+
+    def plan(self, reactions):
+        """
+        Splits reactions by group for update: a list of (group index,
+        members, reactions), one entry per group with members among
+        reactions. Plans hold no scales, so they stay valid for copies
+        made by with_scale.
+        """
+        reactions = np.asarray(reactions, dtype=int)
+        groups = self.group_of[reactions]
+        plan = []
+        for gi in np.unique(groups):
+            members = reactions[groups == gi]
+            plan.append((gi, self.member_of[members], members))
+        return plan
+
+    def update(self, a, x, plan):
+        """ Recomputes in place the propensities a[r] of the plan's reactions. """
+        for gi, members, reactions in plan:
+            a[reactions] = self.groups[gi].subset(x, members)
+
+    def __call__(self, x):
+        x = np.asarray(x)
+        a = np.empty(x.shape[:-1] + (self.n_reactions,))
+        for group in self.groups:
+            a[..., group.reactions] = group(x)
+        return a
@@ -0,0 +1,256 @@
+"""
+On-line reductions of stochastic simulations.
+
+Each reducer is handed the state of every replicate at each output time
+as the solver reaches it (see stoch_engine.Reducer), and keeps only a
+summary: mean traces of groups of cells, the coupling signal, per-cell
+peak times or the Kuramoto order parameter. These are not all constant
+in memory. Trace, MeanTrace and KuramotoOrder allocate their full time
+course when they start, (N, len(tspan), n_observables) or
+(N, len(tspan)), which grows with the run length as recording does, but
+only over a few observables rather than every species. PeakTimes keeps
+at most max_peaks peaks per observable, whatever the run length. Pass
+them to run() by name,
+
+    reductions = compiled.run(y0, reducers=scn_summaries(), record=False)
+    reductions['synchrony']     # order parameter, shape (1, len(tspan))
+
+to analyse long runs or large populations without storing the full
+trajectory matrix. SynchronyStop also ends a run early once its
+synchrony outcome is decided.
+
+John Abel
+"""
+
+from __future__ import division
+
+import numpy as np
+from scipy import sparse
+
+from stoch_engine import Observer, Reducer
+
+
+class Trace(Reducer):
+    """
+    Time course of a few observables (see stoch_engine.Observer), e.g.
+    the coupling signal 'signal' of the SCN models. Result shape
+    (N, len(tspan), n_observables), allocated in full by start; this is
+    recording of the chosen observables, not a constant-size summary.
+    """
+
+    def __init__(self, observables):
+        self.observables = observables
+
+    def observer(self, network):
+        """ Observer of the traced observables """
+        return Observer(network, self.observables)
+
+    def start(self, network, tspan, n_replicates):
+        self.tspan = tspan
+        self.observe = self.observer(network)
+        self.values = np.zeros((n_replicates, len(tspan),
+                                self.observe.n_observables))
+
+    def update(self, k, rows, X):
+        self.values[rows, k] = self.observe(X)
+
+    def result(self):
+        return self.values
+
+
+class MeanTrace(Trace):
+    """
+    Mean over each group of species at every output time, e.g. the mean
+    Per2 of each cell type of the SCN models with groups
+    ['per2_avp', 'per2_vip', 'per2_nav']. Groups are lists of species
+    names or indices, or names of network.observables. Result shape
+    (N, len(tspan), len(groups)).
+    """
+
+    def __init__(self, groups):
+        self.groups = list(groups)
+
+    def observer(self, network):
+        """ Observer whose rows average the species of each group """
+        weights = sparse.lil_matrix((len(self.groups), network.n_species))
+        for gi, group in enumerate(self.groups):
+            index = Observer(network, group).index
+            if len(index):
+                weights[gi, index] = 1/len(index)
+        return Observer(network, weights.tocsr())
+
+
+class PeakTimes(Reducer):
+    """
+    Peak times of each observable, e.g. of 'per2' for every cell. A
+    trace is high once it rises above (1+band) times its running mean
+    and low once it falls below (1-band) times it; the peak of a cycle
+    is the time of the maximum of a high stretch that was entered from
+    low, so noise within the band does not add peaks. Peaks are known
+    once the trace has fallen low again. Result shape
+    (N, n_observables, max_peaks), NaN past the last peak.
+    """
+
+    def __init__(self, observables, band=0.1, max_peaks=32):
+        self.observables = observables
+        self.band = band
+        self.max_peaks = max_peaks
+
+    def start(self, network, tspan, n_replicates):
+        self.tspan = tspan
+        self.observe = Observer(network, self.observables)
+        shape = (n_replicates, self.observe.n_observables)
+        self.total = np.zeros(shape)
+        self.count = np.zeros(n_replicates)
+        # -1 low, 1 high, 0 not yet known
+        self.state = np.zeros(shape, dtype=int)
+        self.high_value = np.zeros(shape)
+        self.high_time = np.zeros(shape)
+        self.n_peaks = np.zeros(shape, dtype=int)
+        self.last_peak = np.zeros(shape) + np.nan
+        self.previous_peak = np.zeros(shape) + np.nan
+        self.peaks = np.zeros(shape + (self.max_peaks,)) + np.nan
+
+    def update(self, k, rows, X):
+        y = self.observe(X)
+        t = np.zeros(y.shape) + self.tspan[k][:, None]
+        self.total[rows] += y
+        self.count[rows] += 1
+        mean = self.total[rows]/self.count[rows][:, None]
+
+        state = self.state[rows]
+        high_value = self.high_value[rows]
+        high_time = self.high_time[rows]
+
+        rising = (state == -1) & (y > (1+self.band)*mean)
+        state[rising] = 1
+        high_value[rising] = -np.inf
+        climbing = (state == 1) & (y > high_value)
+        high_value[climbing] = y[climbing]
+        high_time[climbing] = t[climbing]
+
+        falling = (state == 1) & (y < (1-self.band)*mean)
+        r, c = np.nonzero(falling)
+        if len(r):
+            rr = rows[r]
+            n = self.n_peaks[rr, c]
+            kept = n < self.max_peaks
+            self.peaks[rr[kept], c[kept], n[kept]] = high_time[r, c][kept]
+            self.n_peaks[rr, c] += 1
+            self.previous_peak[rr, c] = self.last_peak[rr, c]
+            self.last_peak[rr, c] = high_time[r, c]
+        state[falling] = -1
+        state[(state == 0) & (y < (1-self.band)*mean)] = -1
+
+        self.state[rows] = state
+        self.high_value[rows] = high_value
+        self.high_time[rows] = high_time
+
+    def phases(self, rows, t):
+        """
+        Phases at times t of replicates rows, extrapolated from the last
+        two peaks of each trace; NaN before the second peak.
+        """
+        last = self.last_peak[rows]
+        period = last - self.previous_peak[rows]
+        return 2*np.pi*(t[:, None] - last)/period
+
+    def result(self):
+        return self.peaks
+
+
+class KuramotoOrder(Reducer):
+    """
+    Kuramoto order parameter R = |mean(exp(i*phase))| of the observables
+    at each output time, with the phase of each trace taken from its
+    peaks (see PeakTimes.phases). Traces without two peaks yet are left
+    out; R is NaN until some trace has two. Result shape
+    (N, len(tspan)).
+    """
+
+    def __init__(self, observables, band=0.1):
+        self.peaks = PeakTimes(observables, band=band, max_peaks=1)
+
+    def start(self, network, tspan, n_replicates):
+        self.tspan = tspan
+        self.peaks.start(network, tspan, n_replicates)
+        self.values = np.zeros((n_replicates, len(tspan))) + np.nan
+
+    def update(self, k, rows, X):
+        self.peaks.update(k, rows, X)
+        phases = self.peaks.phases(rows, self.tspan[k])
+        known = np.isfinite(phases)
+        n_known = known.sum(1)
+        z = np.where(known, np.exp(1j*np.where(known, phases, 0)), 0).sum(1)
+        some = n_known > 0
+        self.values[rows[some], k[some]] = np.abs(z[some])/n_known[some]
+
+    def result(self):
+        return self.values
+
+
+class SynchronyStop(KuramotoOrder):
+    """
+    Kuramoto order parameter (see KuramotoOrder) that decides the
+    synchrony outcome of each replicate: resynchronized once R stays at
+    or above high for window time units, desynchronized once it stays at
+    or below low as long. The run stops when every replicate is decided
+    (see stoch_engine.Reducer.decided), so use it for exploratory sweeps
+    where only the phenotype matters, not for runs that feed MIC. Result
+    a dict: 'synchrony', the order parameter, shape (N, len(tspan)), NaN
+    after the stop; 'outcome', 1 resynchronized, -1 desynchronized or 0
+    undecided, shape (N,); and 'time', the time of the decision, NaN if
+    undecided.
+    """
+
+    def __init__(self, observables, high=0.9, low=0.3, window=72.,
+                 band=0.1):
+        KuramotoOrder.__init__(self, observables, band=band)
+        self.high = high
+        self.low = low
+        self.window = window
+
+    def start(self, network, tspan, n_replicates):
+        KuramotoOrder.start(self, network, tspan, n_replicates)
+        # 1 above high, -1 below low, 0 between or not yet known
+        self.side = np.zeros(n_replicates, dtype=int)
+        self.since = np.zeros(n_replicates) + np.nan
+        self.outcome = np.zeros(n_replicates, dtype=int)
+        self.time = np.zeros(n_replicates) + np.nan
+
+    def update(self, k, rows, X):
+        KuramotoOrder.update(self, k, rows, X)
+        t = self.tspan[k]
+        R = self.values[rows, k]
+        # R is NaN until the first phases are known
+        with np.errstate(invalid='ignore'):
+            side = np.where(R >= self.high, 1,
+                            np.where(R <= self.low, -1, 0))
+        entered = side != self.side[rows]
+        self.since[rows[entered]] = t[entered]
+        self.side[rows] = side
+
+        decided = (side != 0) & (self.outcome[rows] == 0)
+        decided[decided] = (t - self.since[rows])[decided] >= self.window
+        self.outcome[rows[decided]] = side[decided]
+        self.time[rows[decided]] = t[decided]
+
+    def decided(self, rows):
+        return self.outcome[rows] != 0
+
+    def result(self):
+        return {'synchrony': self.values, 'outcome': self.outcome,
+                'time': self.time}
+
+
+def scn_summaries(band=0.1):
+    """
+    Reducers for the SCN models: 'mean_per2', the mean Per2 trace of the
+    AVP, VIP and NAV cells; 'signal', the AVP/VIP coupling signal;
+    'peaks', the Per2 peak times of every cell; and 'synchrony', the
+    Kuramoto order parameter of the Per2 rhythms.
+    """
+    return {'mean_per2': MeanTrace(['per2_avp', 'per2_vip', 'per2_nav']),
+            'signal': Trace('signal'),
+            'peaks': PeakTimes('per2', band=band),
+            'synchrony': KuramotoOrder('per2', band=band)}
@@ -0,0 +1,552 @@
+"""
+Created on 9 Aug 2018
+
+@author: John H. Abel
+
+Parametric many-cell version of the model from Gonze 2005, for the
+stochastic SCN simulations. Cells are AVP (states X1, Y1, Z1, A1), VIP
+(X2, Y2, Z2, V2) or NAV (X3, Y3, Z3); every cell is driven by the mean
+AVP and VIP signal, weighted kav:1.
+
+The network is built from array templates rather than per-cell
+gillespy objects: each reaction type is one propensity template bound
+to an index array over the cells, and the AVP and VIP sums of the
+signal are aggregates of the A1*/V2* species. The structure depends only on the
+cell counts, kav, volume and parameters, and is cached on those, so
+building a model for a new initial condition or knockout reuses it.
+gillespy species and reactions are only created if the model is run
+through StochKit.
+
+Cells may also be coupled through a sparse graph (see scn_topology.py)
+in place of the mean field. Each cell then has its own AVP and VIP input
+aggregates, updated when a neighbouring A1/V2 species changes, which
+scales to populations of thousands of cells.
+"""
+
+# common imports
+from __future__ import division
+from collections import OrderedDict
+import hashlib
+
+# python packages
+import numpy as np
+from scipy import sparse
+import gillespy as gsp
+
+from propensities import (PropensityGroup, CompiledPropensities, slot_name,
+                          value_name)
+from stoch_engine import (InProcessModel, ReactionNetwork, simulate,
+                          simulate_ensemble)
+
+modelversion = 'gonze_model_manycell'
+
+param = [  0.7,    1,    4, 0.35,    1,  0.7, 0.35,
+             1,  0.7, 0.35,    1, 0.35,    1,    1,
+           0.4,    1,  0.75,    0
+           ]
+
+pnames = ['v1','K1','n','v2','K2','k3','v4','K4',
+          'k5','v6','K6','k7','v8','K8','vc','Kc','K','L']
+
+period = 35.111795693955706
+
+# reaction types, in the order the reactions of each cell are listed.
+# (name, changed state, template, states bound to _s0, _s1, ...); AVP and
+# VIP are the aggregates summing the A1* and V2* species
+reaction_types = [
+    ('production', 'X', 'vol*v1*K1*K1*K1*K1/(K1*K1*K1*K1+(_s0/vol)*'
+                        '(_s0/vol)*(_s0/vol)*(_s0/vol))', 'Z'),
+    ('degradation', 'X', 'vol*v2*(_s0/vol)/(K2+_s0/vol)', 'X'),
+    ('coupling', 'X', 'vol*vc*K*(_sig/vol)/(Kc+K*(_sig/vol))', 'AVP VIP'),
+    ('production', 'Y', 'k3*_s0', 'X'),
+    ('degradation', 'Y', 'vol*v4*(_s0/vol)/(K4+_s0/vol)', 'Y'),
+    ('production', 'Z', 'k5*_s0', 'Y'),
+    ('degradation', 'Z', 'vol*v6*(_s0/vol)/(K6+_s0/vol)', 'Z'),
+    ('production', 'A', 'k7*_s0', 'X'),
+    ('degradation', 'A', 'vol*v8*(_s0/vol)/(K8+_s0/vol)', 'A'),
+    ]
+
+# Bmal1 knockout scales the X production and the initial A/V of a cell
+bmalko_scale = 0.05
+
+# cached SCNStructures
+_structures = {}
+
+
+class SCNStructure(object):
+    """
+    Species, reactions and propensity templates of an SCN network for
+    given cell counts, kav, volume and parameters. Use scn_structure() to
+    get a cached instance.
+    """
+
+    def __init__(self, AVPcells, VIPcells, NAVcells, kav, volume=1000,
+                 parameter_values=param, coupling_norm=None, coupling=None):
+        """
+        ----
+        AVPcells, VIPcells, NAVcells : int
+            number of cells of each type.
+        kav : float
+            AVP:VIP signal strength ratio.
+        volume : float
+            system volume, converting concentration to counts.
+        coupling_norm : optional float
+            the signal is (ka*sum(A) + kv*sum(V))/(coupling_norm*vol).
+            Defaults to (AVPcells+VIPcells)/2, as in the original models,
+            or with a coupling graph, to half the inputs of each cell.
+        coupling : optional sparse matrix, shape (ncells, nsig)
+            coupling graph (see scn_topology.py); the sums of the signal
+            of cell i are then weighted by row i. Default mean field.
+        """
+        self.AVPcells = AVPcells
+        self.VIPcells = VIPcells
+        self.NAVcells = NAVcells
+        self.kav = kav
+        self.volume = volume
+        if coupling is not None:
+            coupling = sparse.csr_matrix(coupling, dtype=float)
+        self.coupling = coupling
+        if coupling_norm is None and coupling is None:
+            coupling_norm = (AVPcells+VIPcells)/2
+        self.coupling_norm = coupling_norm
+
+        self.parameters = OrderedDict([('vol', float(volume))])
+        for name, value in zip(pnames, parameter_values):
+            self.parameters[name] = float(value)
+
+        # states of each cell, AVP then VIP then NAV
+        nsig = AVPcells + VIPcells
+        ncells = nsig + NAVcells
+        self.cell_types = np.array([1]*AVPcells + [2]*VIPcells +
+                                   [3]*NAVcells)
+        cell_index = np.hstack([np.arange(AVPcells), np.arange(VIPcells),
+                                np.arange(NAVcells)])
+        states_per_cell = np.where(self.cell_types < 3, 4, 3)
+        first = np.hstack([0, np.cumsum(states_per_cell)[:-1]])
+        self.n_species = states_per_cell.sum()
+        self.state_index = {'X': first, 'Y': first+1, 'Z': first+2,
+                            'A': np.where(self.cell_types < 3, first+3, -1)}
+
+        fourth = np.where(self.cell_types == 1, 'A', 'V')
+        self.species = []
+        for ci in range(ncells):
+            ct, idx = str(self.cell_types[ci]), str(cell_index[ci])
+            self.species += [s + ct + idx for s in 'XYZ']
+            if self.cell_types[ci] < 3:
+                self.species += [fourth[ci] + ct + idx]
+
+        # aggregates sum(A1) and sum(V2); integer counts, so that their
+        # running totals stay exact. The signal weights them ka:kv.
+        ka = kav/(kav+1.)
+        kv = 1/(kav+1.)
+        if coupling is None:
+            self.aggregate_weights = sparse.csr_matrix(
+                (np.ones(nsig), (self.cell_types[:nsig]-1,
+                                 self.state_index['A'][:nsig])),
+                shape=(2, self.n_species))
+            self.state_index['AVP'] = np.repeat(self.n_species, ncells)
+            self.state_index['VIP'] = np.repeat(self.n_species+1, ncells)
+            signal = '(%r*_s0+%r*_s1)/%r' % (ka, kv, float(coupling_norm))
+            self.input_scale = None
+        else:
+            # one AVP and one VIP input sum per cell, over its row of the
+            # graph; the normalization of each cell is a member constant
+            assert coupling.shape == (ncells, nsig), \
+                    "Need a coupling graph of shape (ncells, nsig)."
+            W = coupling.tocoo()
+            self.aggregate_weights = sparse.csr_matrix(
+                (W.data, (W.row + ncells*(W.col >= AVPcells),
+                          self.state_index['A'][W.col])),
+                shape=(2*ncells, self.n_species))
+            self.state_index['AVP'] = self.n_species + np.arange(ncells)
+            self.state_index['VIP'] = (self.n_species + ncells +
+                                       np.arange(ncells))
+            signal = '(%r*_s0+%r*_s1)*%s' % (ka, kv, value_name(0))
+            if coupling_norm is None:
+                norm = np.asarray(coupling.sum(1)).ravel()/2
+            else:
+                norm = np.repeat(float(coupling_norm), ncells)
+            self.input_scale = np.where(norm > 0, 1/np.maximum(norm, 1E-300),
+                                        0.)
+
+        # reactions of each cell are consecutive, NAV cells have no A
+        rxns_per_cell = np.where(self.cell_types < 3, len(reaction_types),
+                                 len(reaction_types)-2)
+        first_rxn = np.hstack([0, np.cumsum(rxns_per_cell)[:-1]])
+        self.n_reactions = rxns_per_cell.sum()
+
+        self.templates = []
+        self.reaction_names = [None]*self.n_reactions
+        changed = np.zeros(self.n_reactions, dtype=int)
+        change = np.zeros(self.n_reactions)
+        for ri, (kind, state, template, reads) in enumerate(reaction_types):
+            cells = np.arange(ncells)
+            if state == 'A': cells = cells[:nsig]
+            reactions = first_rxn[cells] + ri
+            index = np.array([self.state_index[si][cells]
+                              for si in reads.split()]).T
+            values = None
+            if '_sig' in template and self.input_scale is not None:
+                values = self.input_scale[cells][:, None]
+            self.templates.append((template.replace('_sig', signal),
+                                   reactions, index, values))
+
+            changed[reactions] = self.state_index[state][cells]
+            change[reactions] = 1 if kind in ('production', 'coupling') else -1
+            for rxn, ci in zip(reactions, cells):
+                self.reaction_names[rxn] = (self.species[
+                    self.state_index[state][ci]] + '_' + kind)
+
+        self.stoichiometry = sparse.csr_matrix(
+            (change, (np.arange(self.n_reactions), changed)),
+            shape=(self.n_reactions, self.n_species))
+
+        self._networks = {}
+
+    def _bmalko_factors(self, bmalko):
+        """
+        knockout factor of each cell. bmalko is 'None', 'AVP', 'VIP' or
+        'AVPVIP', or an array of factors, one per cell.
+        """
+        if not isinstance(bmalko, str):
+            factors = np.asarray(bmalko, dtype=float)
+            assert factors.shape == self.cell_types.shape, \
+                    "Need one knockout factor per cell."
+            return factors
+        factors = np.ones(len(self.cell_types))
+        if bmalko in ('AVP', 'AVPVIP'):
+            factors[self.cell_types == 1] = bmalko_scale
+        if bmalko in ('VIP', 'AVPVIP'):
+            factors[self.cell_types == 2] = bmalko_scale
+        return factors
+
+    def reaction_scale(self, bmalko='None'):
+        """ factor multiplying each propensity, for a knockout """
+        scale = np.ones(self.n_reactions)
+        template, reactions, index, values = self.templates[0]
+        scale[reactions] = self._bmalko_factors(bmalko)
+        return scale
+
+    def network(self, bmalko='None'):
+        """
+        ReactionNetwork for a knockout, with x0 = 0. All knockouts share
+        the propensity kernels; networks of named knockouts are cached.
+        """
+        if 'None' not in self._networks:
+            groups = [PropensityGroup(template, reactions, index,
+                                      np.ones(len(reactions)),
+                                      self.parameters, values)
+                      for template, reactions, index, values
+                      in self.templates]
+            network = ReactionNetwork(
+                self.species, np.zeros(self.n_species), self.stoichiometry,
+                CompiledPropensities(groups, self.n_reactions),
+                self.aggregate_weights, self.parameters,
+                self.reaction_names)
+            network.observables.update(self.observables())
+            self._networks['None'] = network
+        if not isinstance(bmalko, str):
+            return self._networks['None'].with_scale(
+                self.reaction_scale(bmalko))
+        if bmalko not in self._networks:
+            self._networks[bmalko] = self._networks['None'].with_scale(
+                self.reaction_scale(bmalko))
+        return self._networks[bmalko]
+
+    def observables(self):
+        """
+        Named observables of the network: 'per2', the X of every cell,
+        and 'per2_avp', 'per2_vip' and 'per2_nav', of the cells of one
+        type; 'avp' and 'vip', the A1 and V2 of the signaling cells;
+        'signal', the coupling signal
+        (ka*sum(A1) + kv*sum(V2))/(coupling_norm*vol) seen by every cell,
+        or with a coupling graph, the signal seen by each cell.
+        """
+        nsig = self.AVPcells + self.VIPcells
+        ka = self.kav/(self.kav+1.)
+        kv = 1/(self.kav+1.)
+        if self.coupling is None:
+            signal = sparse.lil_matrix((1, self.n_species))
+            signal[0, self.state_index['A'][:self.AVPcells]] = ka
+            signal[0, self.state_index['A'][self.AVPcells:nsig]] = kv
+            signal = signal.tocsr()/(self.coupling_norm*self.volume)
+        else:
+            weights = sparse.diags(np.where(np.arange(nsig) < self.AVPcells,
+                                            ka, kv))
+            signal = sparse.diags(self.input_scale/self.volume).dot(
+                self.coupling.dot(weights)).dot(sparse.csr_matrix(
+                    (np.ones(nsig), (np.arange(nsig),
+                                     self.state_index['A'][:nsig])),
+                    shape=(nsig, self.n_species))).tocsr()
+        X = self.state_index['X']
+        return {'per2': X,
+                'per2_avp': X[self.cell_types == 1],
+                'per2_vip': X[self.cell_types == 2],
+                'per2_nav': X[self.cell_types == 3],
+                'avp': self.state_index['A'][:self.AVPcells],
+                'vip': self.state_index['A'][self.AVPcells:nsig],
+                'signal': signal}
+
+    def initial_counts(self, initial_values, bmalko='None'):
+        """
+        Species counts for concentrations initial_values, which list the
+        states of the AVP, VIP and NAV cells in turn. The knockout scales
+        the initial A/V of the affected cells. With no initial_values,
+        all counts are zero.
+        """
+        if not len(initial_values):
+            return np.zeros(self.n_species)
+        y0 = np.asarray(initial_values, dtype=float)
+        return np.trunc(self.initial_scale(bmalko)*y0*self.volume)
+
+    def initial_scale(self, bmalko='None'):
+        """ factor of each initial value, for a knockout """
+        factors = np.ones(self.n_species)
+        nsig = self.AVPcells + self.VIPcells
+        factors[self.state_index['A'][:nsig]] = \
+            self._bmalko_factors(bmalko)[:nsig]
+        return factors
+
+    def propensity_strings(self, bmalko='None'):
+        """ gillespy propensity expressions of all reactions """
+        names = list(self.species)
+        weights = self.aggregate_weights.tocsr()
+        weights.sort_indices()
+        for row in range(weights.shape[0]):
+            members = slice(weights.indptr[row], weights.indptr[row+1])
+            names.append('(0' + ''.join(
+                '+' + ('%r*' % w if w != 1 else '') + self.species[i]
+                for i, w in zip(weights.indices[members],
+                                weights.data[members])) + ')')
+        scale = self.reaction_scale(bmalko)
+
+        strings = [None]*self.n_reactions
+        for template, reactions, index, values in self.templates:
+            for m, (rxn, slots) in enumerate(zip(reactions, index)):
+                string = template
+                for k, si in enumerate(slots):
+                    string = string.replace(slot_name(k), names[si])
+                if values is not None:
+                    for k, value in enumerate(values[m]):
+                        string = string.replace(value_name(k), repr(value))
+                strings[rxn] = (('%r*' % scale[rxn] if scale[rxn] != 1 else '')
+                                + string)
+        return strings
+
+
+def _graph_key(coupling):
+    """ hashable digest of a coupling graph """
+    if coupling is None:
+        return None
+    W = sparse.csr_matrix(coupling, dtype=float)
+    W.sum_duplicates()
+    digest = hashlib.sha1()
+    for array in (np.array(W.shape), W.indptr, W.indices, W.data):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def scn_structure(AVPcells, VIPcells, NAVcells, kav, volume=1000,
+                  parameter_values=param, coupling_norm=None, coupling=None):
+    """ Returns the cached SCNStructure for these arguments. """
+    key = (AVPcells, VIPcells, NAVcells, kav, volume,
+           tuple(parameter_values), coupling_norm, _graph_key(coupling))
+    if key not in _structures:
+        _structures[key] = SCNStructure(AVPcells, VIPcells, NAVcells, kav,
+                                        volume, parameter_values,
+                                        coupling_norm, coupling)
+    return _structures[key]
+
+
+class SCNModel(InProcessModel, gsp.Model):
+    """
+    Stochastic many-cell SCN model, built from a cached SCNStructure.
+    """
+
+    def __init__(self, parameter_values=param, initial_values=[],
+                 bmalko='None', AVPcells=53, VIPcells=27, NAVcells=40,
+                 kav=2.5, volume=1000, timespan=None, name='gonze120',
+                 coupling=None):
+        """
+        ----
+        initial_values : iterable
+            concentrations of the AVP, VIP and NAV cell states in turn,
+            4 states per AVP/VIP cell and 3 per NAV cell.
+        bmalko : 'None', 'AVP', 'VIP' or 'AVPVIP', or array
+            cells with Bmal1 knocked out, or the knockout factor of each
+            cell.
+        timespan : optional iterable
+            output times, default 7 periods at 4 points per hour.
+        coupling : optional sparse matrix
+            coupling graph, see SCNStructure. Default mean field.
+        """
+        gsp.Model.__init__(self, name=name, volume=volume)
+        if timespan is None:
+            timespan = np.linspace(0,7*period,7*4*24+1)
+        self.timespan(timespan)
+
+        self.structure = scn_structure(AVPcells, VIPcells, NAVcells, kav,
+                                       volume, parameter_values,
+                                       coupling=coupling)
+        self.parameter_values = parameter_values
+        self.bmalko = bmalko
+        self._network = self.structure.network(bmalko).with_x0(
+            self.structure.initial_counts(initial_values, bmalko))
+
+    def set_initial_values(self, initial_values):
+        """
+        Replaces the initial values (see __init__), also in the gillespy
+        species if they are built. Reactions and parameters are kept.
+        """
+        self._network = self.structure.network(self.bmalko).with_x0(
+            self.structure.initial_counts(initial_values, self.bmalko))
+        for si, species in enumerate(self.listOfSpecies.values()):
+            species.initial_value = int(self._network.x0[si])
+
+    def build_gillespy(self):
+        """
+        Adds the gillespy parameters, species and reactions, as needed to
+        run through StochKit.
+        """
+        if len(self.listOfReactions): return
+        st = self.structure
+        self.add_parameter([gsp.Parameter(name=name, expression=value)
+                            for name, value in zip(pnames,
+                                                   self.parameter_values)])
+        sd = OrderedDict()
+        for si, name in enumerate(st.species):
+            sd[name] = gsp.Species(name=name,
+                                   initial_value=int(self._network.x0[si]))
+        self.add_species(sd.values())
+
+        strings = st.propensity_strings(self.bmalko)
+        changes = st.stoichiometry.tocoo()
+        for rxn, si, change in zip(changes.row, changes.col, changes.data):
+            species = sd[st.species[si]]
+            self.add_reaction(gsp.Reaction(
+                name=st.reaction_names[rxn],
+                reactants={species: 1} if change < 0 else {},
+                products={species: 1} if change > 0 else {},
+                propensity_function=strings[rxn]))
+
+    def run(self, number_of_trajectories=1, seed=None, show_labels=False,
+            solver='stochkit', **solver_options):
+        if solver == 'stochkit': self.build_gillespy()
+        return InProcessModel.run(self, number_of_trajectories, seed,
+                                  show_labels, solver, **solver_options)
+    run.__doc__ = InProcessModel.run.__doc__
+
+
+class CompiledSCNModel(object):
+    """
+    SCN model compiled once for a configuration (cell counts, kav), and
+    re-run with new initial values and knockouts. Runs only compute the
+    initial counts; a new knockout rescales the shared propensity
+    kernels. No species, reactions or parameters are rebuilt: for
+    StochKit, the gillespy model of each named knockout is built once
+    and only its species initial values are reset on later runs.
+    """
+
+    def __init__(self, AVPcells, VIPcells, NAVcells, kav, volume=1000,
+                 timespan=None, parameter_values=param, coupling=None):
+        if timespan is None:
+            timespan = np.linspace(0,7*period,7*4*24+1)
+        self.tspan = np.asarray(timespan, dtype=float)
+        self.parameter_values = parameter_values
+        self.structure = scn_structure(AVPcells, VIPcells, NAVcells, kav,
+                                       volume, parameter_values,
+                                       coupling=coupling)
+        # SCNModels of named knockouts, see model()
+        self._models = {}
+
+    def network(self, initial_values=[], bmalko='None'):
+        """ ReactionNetwork for these initial values and knockout """
+        return self.structure.network(bmalko).with_x0(
+            self.structure.initial_counts(initial_values, bmalko))
+
+    def run(self, initial_values, bmalko='None', number_of_trajectories=1,
+            seed=None, show_labels=False, solver='stochkit',
+            **solver_options):
+        """
+        Simulates from initial_values with knockout bmalko (see
+        SCNModel). Other arguments and the return value are as for
+        SCNModel.run.
+        """
+        if solver == 'stochkit':
+            return self.model(initial_values, bmalko).run(
+                number_of_trajectories, seed, show_labels, solver,
+                **solver_options)
+        return simulate(self.network(initial_values, bmalko), self.tspan,
+                        number_of_trajectories, seed, show_labels, solver,
+                        **solver_options)
+
+    def run_ensemble(self, initial_values, bmalko='None', seed=None,
+                     solver='direct', **solver_options):
+        """
+        Simulates one replicate per row of initial_values, shape
+        (N, n_values), in one vectorized pass. Returns the species counts,
+        shape (N, len(tspan), n_species), or the observables if given.
+        """
+        X0 = self.structure.initial_counts(np.atleast_2d(initial_values),
+                                           bmalko)
+        return simulate_ensemble(self.structure.network(bmalko), self.tspan,
+                                 X0, seed=seed, solver=solver,
+                                 **solver_options)
+
+    def model(self, initial_values=[], bmalko='None'):
+        """
+        SCNModel for these initial values and knockout. Models of named
+        knockouts are cached: later calls reset the initial values of the
+        same model, so its gillespy species and reactions are built once.
+        """
+        st = self.structure
+        if not isinstance(bmalko, str):
+            return SCNModel(self.parameter_values, initial_values, bmalko,
+                            st.AVPcells, st.VIPcells, st.NAVcells, st.kav,
+                            st.volume, self.tspan, coupling=st.coupling)
+        if bmalko not in self._models:
+            self._models[bmalko] = SCNModel(
+                self.parameter_values, [], bmalko, st.AVPcells, st.VIPcells,
+                st.NAVcells, st.kav, st.volume, self.tspan,
+                coupling=st.coupling)
+        model = self._models[bmalko]
+        model.timespan(self.tspan)
+        model.set_initial_values(initial_values)
+        return model
+
+
+def random_phase_y0(oscillator, AVPcells, VIPcells, NAVcells,
+                    random_state=None, **phase_options):
+    """
+    Initial concentrations of an SCN model with every cell at a random
+    phase of the single-cell limit cycle of oscillator (a
+    LimitCycle.Oscillator of gonze_model): all states for the AVP and
+    VIP cells, all but A for the NAV cells, drawn in that order as by
+    wt_T*random_state.rand() per cell. phase_options (coherence,
+    mean_phase) are those of Oscillator.random_phase_times.
+
+    random_state may also be a list of RandomStates, one per replicate;
+    the result is then a stack, shape (replicates, n_values), from one
+    evaluation of the limit cycle.
+    """
+    streams = random_state
+    if not isinstance(random_state, (list, tuple)):
+        streams = [random_state]
+    ncells = AVPcells + VIPcells + NAVcells
+    nsig = AVPcells + VIPcells
+    times = np.hstack([oscillator.random_phase_times(ncells, stream,
+                                                     **phase_options)
+                       for stream in streams])
+    states = oscillator.lc(times).reshape(len(streams), ncells, -1)
+    y0 = np.hstack([states[:, :nsig].reshape(len(streams), -1),
+                    states[:, nsig:, :-1].reshape(len(streams), -1)])
+    return y0 if streams is random_state else y0[0]
+
+
+def build_scn_model(AVPcells, VIPcells, NAVcells, kav, bmalko='None',
+                    volume=1000, timespan=None, initial_values=[],
+                    parameter_values=param, coupling=None):
+    """ Model factory, returns an SCNModel. """
+    return SCNModel(parameter_values, initial_values, bmalko, AVPcells,
+                    VIPcells, NAVcells, kav, volume, timespan,
+                    coupling=coupling)
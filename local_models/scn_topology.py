@@ -0,0 +1,90 @@
+"""
+Coupling graphs for the SCN models.
+
+A coupling graph is a sparse matrix W of shape (ncells, nsig): W[i, j]
+is the weight of the signal of signaling cell j (AVP cells, then VIP
+cells) in the coupling input of cell i (AVP, VIP, then NAV cells). The
+default, W = 1 for every pair, is the mean-field coupling of the
+original models. Pass a graph to SCNStructure (or SCNModel,
+CompiledSCNModel) as coupling; integer weights keep the per-cell input
+sums exact.
+
+    W = small_world(AVPcells, VIPcells, NAVcells, degree=20, rewire=0.1,
+                    random_state=0)
+    compiled = CompiledSCNModel(AVPcells, VIPcells, NAVcells, kav,
+                                coupling=W)
+
+John Abel
+"""
+
+from __future__ import division
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from stoch_engine import check_random_state
+
+
+def all_to_all(AVPcells, VIPcells, NAVcells):
+    """ Mean-field coupling: every cell hears every signaling cell """
+    nsig = AVPcells + VIPcells
+    return sparse.csr_matrix(np.ones((nsig + NAVcells, nsig)))
+
+
+def _signaling_inputs(rows, cols, ncells, nsig):
+    """ W from directed edges cols -> rows, keeping signaling sources """
+    keep = (cols < nsig) & (rows != cols)
+    W = sparse.csr_matrix((np.ones(keep.sum()), (rows[keep], cols[keep])),
+                          shape=(ncells, nsig))
+    # duplicate edges count once
+    W.sum_duplicates()
+    W.data[:] = 1
+    return W
+
+
+def small_world(AVPcells, VIPcells, NAVcells, degree=10, rewire=0.1,
+                random_state=None):
+    """
+    Watts-Strogatz graph: cells on a ring, in random order, each hearing
+    its degree nearest neighbours; each input is then rewired to a random
+    cell with probability rewire. Inputs from NAV cells are dropped, as
+    they do not signal.
+    """
+    random_state = check_random_state(random_state)
+    nsig = AVPcells + VIPcells
+    ncells = nsig + NAVcells
+    ring = random_state.permutation(ncells)
+    offsets = np.hstack([np.arange(1, degree//2+1),
+                         -np.arange(1, degree - degree//2 + 1)])
+    position = np.repeat(np.arange(ncells), len(offsets))
+    rows = ring[position]
+    cols = ring[(position + np.tile(offsets, ncells)) % ncells]
+    rewired = random_state.rand(len(cols)) < rewire
+    cols[rewired] = random_state.randint(ncells, size=rewired.sum())
+    return _signaling_inputs(rows, cols, ncells, nsig)
+
+
+def random_positions(ncells, random_state=None):
+    """ Uniformly random positions of ncells in the unit disk """
+    random_state = check_random_state(random_state)
+    radius = np.sqrt(random_state.rand(ncells))
+    angle = 2*np.pi*random_state.rand(ncells)
+    return np.vstack([radius*np.cos(angle), radius*np.sin(angle)]).T
+
+
+def distance_based(AVPcells, VIPcells, NAVcells, radius=0.1,
+                   positions=None, random_state=None):
+    """
+    Each cell hears the signaling cells within radius of it. positions,
+    shape (ncells, dim), default random_positions in the unit disk.
+    """
+    nsig = AVPcells + VIPcells
+    ncells = nsig + NAVcells
+    if positions is None:
+        positions = random_positions(ncells, random_state)
+    tree = cKDTree(positions)
+    pairs = tree.query_pairs(radius, output_type='ndarray')
+    rows = np.hstack([pairs[:, 0], pairs[:, 1]])
+    cols = np.hstack([pairs[:, 1], pairs[:, 0]])
+    return _signaling_inputs(rows, cols, ncells, nsig)
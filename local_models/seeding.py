@@ -0,0 +1,80 @@
+"""
+Reproducible random streams for the stochastic sweeps.
+
+A SeedTree is a node of a spawn tree in the style of numpy's SeedSequence
+(not available in numpy 1.15): the root holds the entropy of one root
+seed, and each child is identified by a key path from the root, e.g.
+(kav, replicate, 'wt'). The state of a node is a SHA-256 hash of the root
+entropy and its key path, so streams of different nodes are independent
+and do not depend on the order or process in which they are drawn. A
+sweep that derives every random stream from one root seed is therefore
+bit-reproducible for any number of workers.
+
+    seeds = SeedTree(0)
+    ic_rs = seeds.child(kav, replicate, 'initial').random_state()
+    ssa_rs = seeds.child(kav, replicate, 'wt').random_state()
+
+John Abel
+"""
+
+from __future__ import division
+import hashlib
+
+import numpy as np
+
+
+class SeedTree(object):
+    """
+    Node of a seed spawn tree. Nodes are small and picklable, so they can
+    be sent to worker processes in place of random states.
+    """
+
+    def __init__(self, entropy=None, spawn_key=()):
+        """
+        ----
+        entropy : optional int
+            root seed. None draws one from the operating system, see
+            the entropy attribute to reproduce the tree.
+        spawn_key : tuple
+            key path of this node from the root.
+        """
+        if entropy is None:
+            entropy = int(np.random.RandomState().randint(2**31))
+        self.entropy = int(entropy)
+        self.spawn_key = tuple(spawn_key)
+        self.n_children_spawned = 0
+
+    def __repr__(self):
+        return 'SeedTree(%r, spawn_key=%r)' % (self.entropy, self.spawn_key)
+
+    def child(self, *keys):
+        """
+        Child node at key path keys below this node. Keys may be ints,
+        floats or strings; the same path always gives the same node.
+        """
+        # numpy scalars as python numbers, so that keys hash by value
+        keys = tuple(getattr(key, 'item', lambda: key)() for key in keys)
+        return SeedTree(self.entropy, self.spawn_key + keys)
+
+    def spawn(self, n_children):
+        """ n_children new children, numbered on from previous spawns """
+        children = [self.child(self.n_children_spawned + i)
+                    for i in range(n_children)]
+        self.n_children_spawned += n_children
+        return children
+
+    def generate_state(self, n_words=8):
+        """ State of this node, n_words uint32 words """
+        words = []
+        counter = 0
+        while len(words) < n_words:
+            digest = hashlib.sha256(
+                repr((self.entropy, self.spawn_key, counter)).encode()
+                ).digest()
+            words.extend(np.frombuffer(digest, dtype='<u4'))
+            counter += 1
+        return np.array(words[:n_words], dtype=np.uint32)
+
+    def random_state(self):
+        """ New np.random.RandomState seeded from this node """
+        return np.random.RandomState(self.generate_state())
@@ -0,0 +1,1264 @@
+"""
+In-process stochastic simulation of gillespy models.
+
+gillespy 1.1 runs every trajectory by serializing the model to StochKit
+XML, launching the external solver and parsing its text output. For the
+many-cell SCN models this overhead dominates the cost of a single
+trajectory, so here the built model (species, stoichiometry and
+propensities) is converted once to NumPy arrays and simulated directly.
+
+Output follows the gillespy convention: run() returns a list of
+trajectories, each an array of [time, species...].
+
+John Abel
+"""
+
+from __future__ import division
+from collections import OrderedDict
+from copy import copy
+import os
+import pickle
+import time
+
+import numpy as np
+from scipy import sparse
+
+from propensities import CompiledPropensities, functions
+from seeding import SeedTree
+from jit_ssa import ssa_jit
+
+
+def check_random_state(seed):
+    """
+    Turns seed into a np.random.RandomState. None gives the global
+    numpy random state, an int gives a new seeded RandomState, a
+    seeding.SeedTree gives the RandomState of that node, and a
+    RandomState is passed through unchanged.
+    """
+    if seed is None:
+        return np.random.mtrand._rand
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    if isinstance(seed, SeedTree):
+        return seed.random_state()
+    return np.random.RandomState(seed)
+
+
+def _parameter_value(parameter, namespace):
+    """ Returns the numerical value of a gillespy Parameter. """
+    value = getattr(parameter, 'value', None)
+    if value is None:
+        value = eval(str(parameter.expression), dict(functions), namespace)
+    return float(value)
+
+
+class ReactionNetwork(object):
+    """
+    Array representation of a reaction network for the in-process solvers.
+
+    The solver state is the species counts followed by the aggregates
+    found in the propensities (running sums of species, see
+    propensities.py). The stoichiometry is augmented with the change of
+    each aggregate, so every solver keeps the sums current as it applies
+    reactions.
+    """
+
+    def __init__(self, species, x0, stoichiometry, propensities,
+                 aggregate_weights=None, parameters=None,
+                 reaction_names=None):
+        """
+        ----
+        species : list of str
+            species names, in output column order.
+        x0 : iterable
+            initial species counts.
+        stoichiometry : array-like, shape (n_reactions, n_species)
+            net change of each species when each reaction fires.
+        propensities : propensities.CompiledPropensities
+            propensity kernels over the solver state.
+        aggregate_weights : optional array-like, (n_aggregates, n_species)
+            each aggregate is this weighted sum of the species.
+        parameters : optional dict
+            parameter values, including the system volume 'vol'.
+        """
+        self.species = list(species)
+        self.species_index = dict((s, i) for i, s in enumerate(self.species))
+        self.n_species = len(self.species)
+        self.x0 = np.asarray(x0, dtype=float)
+        self.propensities = propensities
+        self.parameters = parameters
+        self.reaction_names = reaction_names
+
+        if aggregate_weights is None:
+            aggregate_weights = sparse.csr_matrix((0, self.n_species))
+        self.aggregate_weights = sparse.csr_matrix(aggregate_weights,
+                                                   dtype=float)
+        self.n_state = self.n_species + self.aggregate_weights.shape[0]
+
+        species_stoichiometry = sparse.csr_matrix(stoichiometry, dtype=float)
+        self.n_reactions = species_stoichiometry.shape[0]
+        self.stoichiometry = sparse.hstack(
+            [species_stoichiometry,
+             species_stoichiometry.dot(self.aggregate_weights.T)],
+            format='csr')
+        self.stoichiometry.eliminate_zeros()
+
+        # named observables for Recorder, e.g. {'per2': species indices}
+        self.observables = {}
+
+        # derived structures, shared with copies made by with_x0
+        self._cache = {}
+
+    @classmethod
+    def from_expressions(cls, species, x0, stoichiometry, propensity_strings,
+                         parameters, reaction_names=None):
+        """
+        Builds the network from gillespy propensity strings. Sums of
+        species in the strings become aggregates.
+        """
+        species_index = dict((s, i) for i, s in enumerate(species))
+        aggregates = []
+        propensities = CompiledPropensities.from_expressions(
+            propensity_strings, species_index, parameters,
+            aggregates=aggregates)
+
+        # aggregate k sums the species in aggregates[k]
+        weights = sparse.lil_matrix((len(aggregates), len(species)))
+        for k, members in enumerate(aggregates):
+            for si in members:
+                weights[k, si] += 1
+        return cls(species, x0, stoichiometry, propensities, weights,
+                   parameters, reaction_names)
+
+    def with_x0(self, x0):
+        """ Copy of the network with initial species counts x0. """
+        network = copy(self)
+        network.x0 = np.asarray(x0, dtype=float)
+        return network
+
+    def with_scale(self, scale):
+        """
+        Copy of the network with the scale factor of the propensity of
+        reaction r set to scale[r], e.g. for a knockout. Kernels are not
+        recompiled.
+        """
+        network = copy(self)
+        network.propensities = self.propensities.with_scale(scale)
+        return network
+
+    def initial_state(self, x0=None):
+        """
+        Solver state for species counts x0 (default self.x0): the counts
+        followed by the aggregates. x0 may be a stack of count vectors.
+        """
+        if x0 is None: x0 = self.x0
+        x0 = np.asarray(x0, dtype=float)
+        aggregates = self.aggregate_weights.dot(x0.T).T
+        return np.concatenate([x0, aggregates], axis=-1)
+
+    def dependency_graph(self):
+        """
+        Reaction dependency graph as a CSR matrix: row r marks the
+        reactions whose propensity changes when r fires, including r.
+        A firing in one cell touches that cell's reactions, plus every
+        coupling reaction if it changes an AVP/VIP aggregate.
+        """
+        if 'dependency_graph' not in self._cache:
+            changes = (self.stoichiometry != 0).astype(int)
+            reads = self.propensities.reads(self.n_state).astype(int)
+            graph = changes.dot(reads.T) + sparse.identity(
+                self.n_reactions, dtype=int, format='csr')
+            graph = graph.tocsr()
+            graph.sort_indices()
+            self._cache['dependency_graph'] = graph
+        return self._cache['dependency_graph']
+
+    def update_plan(self, r):
+        """
+        The dependents of reaction r in the dependency graph, split by
+        propensity group for CompiledPropensities.update.
+        """
+        plans = self._cache.setdefault('update_plans', {})
+        if r not in plans:
+            graph = self.dependency_graph()
+            plans[r] = self.propensities.plan(
+                graph.indices[graph.indptr[r]:graph.indptr[r+1]])
+        return plans[r]
+
+    @classmethod
+    def from_gillespy(cls, model):
+        """
+        Builds the network from a gillespy model. StochKit receives the
+        model volume as the parameter 'vol', so that is done here too.
+        """
+        species = list(model.listOfSpecies.keys())
+        x0 = [model.listOfSpecies[s].initial_value for s in species]
+        species_index = dict((s, i) for i, s in enumerate(species))
+
+        parameters = OrderedDict([('vol', float(model.volume))])
+        for name, par in model.listOfParameters.items():
+            parameters[name] = _parameter_value(par, parameters)
+
+        stoichiometry = sparse.lil_matrix(
+            (len(model.listOfReactions), len(species)))
+        propensity_strings = []
+        for ri, rxn in enumerate(model.listOfReactions.values()):
+            for sp, stoich in rxn.reactants.items():
+                si = species_index[getattr(sp, 'name', sp)]
+                stoichiometry[ri, si] -= stoich
+            for sp, stoich in rxn.products.items():
+                si = species_index[getattr(sp, 'name', sp)]
+                stoichiometry[ri, si] += stoich
+            # mass-action reactions carry a generated propensity_function
+            propensity_strings.append(rxn.propensity_function)
+
+        return cls.from_expressions(species, x0, stoichiometry,
+                                    propensity_strings, parameters,
+                                    list(model.listOfReactions.keys()))
+
+
+class Observer(object):
+    """
+    Evaluates observables of a network on states or stacks of states.
+
+    observables may be None (all species), a list of species names or
+    indices, a matrix of shape (n_observables, n_species) whose rows are
+    linear combinations of the species, or the name of an entry of
+    network.observables (e.g. 'per2' for the SCN models).
+    """
+
+    def __init__(self, network, observables=None):
+        self.n_species = network.n_species
+        if isinstance(observables, str):
+            if observables not in network.observables:
+                raise KeyError("Unknown observable %r, expected one of %s."
+                               % (observables, sorted(network.observables)))
+            observables = network.observables[observables]
+
+        self.index = None
+        self.weights = None
+        if observables is None:
+            self.index = np.arange(network.n_species)
+            self.labels = list(network.species)
+        elif sparse.issparse(observables) or np.ndim(observables) == 2:
+            self.weights = sparse.csr_matrix(observables, dtype=float)
+            self.labels = ['observable%d' % i
+                           for i in range(self.weights.shape[0])]
+        else:
+            self.index = np.array([self._species(network, o)
+                                   for o in observables], dtype=int)
+            self.labels = [network.species[i] for i in self.index]
+        self.n_observables = len(self.labels)
+
+    @staticmethod
+    def _species(network, species):
+        """ index of a species, given by name or index """
+        if species in network.species_index:
+            return network.species_index[species]
+        if (isinstance(species, (int, long, np.integer)) and
+                0 <= species < network.n_species):
+            return species
+        raise KeyError("Unknown species %r." % (species,))
+
+    def __call__(self, x):
+        """ observables of a state x, or of a stack of states """
+        if self.weights is None:
+            return x[..., self.index]
+        return self.weights.dot(x[..., :self.n_species].T).T
+
+
+class Reducer(object):
+    """
+    Base class of on-line reductions of a simulation. A reducer is handed
+    the state of each replicate at each output time as the solver
+    reaches it, and keeps only running summaries, so that the trajectory
+    matrix need not be stored. Subclasses are in reducers.py.
+    """
+
+    def start(self, network, tspan, n_replicates):
+        """ Resets the reducer for n_replicates runs of network over tspan """
+        self.tspan = tspan
+
+    def update(self, k, rows, X):
+        """
+        Takes the states X, shape (len(rows), n_state), of replicates rows
+        at output times tspan[k]. Each replicate is handed its output
+        times in order, but replicates may be at different times.
+        """
+        raise NotImplementedError
+
+    def result(self):
+        """ The reduction, after the last update """
+        raise NotImplementedError
+
+    def decided(self, rows):
+        """
+        True for each of the replicates rows whose outcome this reducer
+        already knows. A simulation stops early once a reducer has
+        decided every replicate (see Recorder); the base class never
+        decides, so the run covers the full tspan.
+        """
+        return np.zeros(len(rows), dtype=bool)
+
+
+class StopSimulation(Exception):
+    """
+    Raised by Recorder to end a simulation before the last output time,
+    once a reducer has decided every replicate.
+    """
+    pass
+
+
+class Recorder(object):
+    """
+    Keeps the observed values of a simulation at its output times. The
+    solvers hand it the state at each output time, and it stores only the
+    observables (see Observer) and passes the state on to any reducers.
+    With store False, only the reducers are kept. If a reducer decides
+    every replicate (see Reducer.decided), the recorder raises
+    StopSimulation; output times not reached are left as NaN.
+    """
+
+    def __init__(self, network, n_times, observables=None, n_replicates=None,
+                 reducers=(), store=True, replicate=0):
+        """
+        ----
+        reducers : iterable of Reducer
+            started reducers, updated at every output time.
+        replicate : int
+            reducer row of a single trajectory (n_replicates None).
+        """
+        self.observe = Observer(network, observables)
+        self.labels = self.observe.labels
+        self.n_observables = self.observe.n_observables
+        self.n_times = n_times
+        self.reducers = list(reducers)
+        if n_replicates is None:
+            self.rows = np.array([replicate])
+        else:
+            self.rows = np.arange(n_replicates)
+
+        self.values = None
+        if store:
+            shape = (n_times, self.n_observables)
+            if n_replicates is not None:
+                shape = (n_replicates,) + shape
+            self.values = np.empty(shape)
+            self.values.fill(np.nan)
+
+    def _reduce(self, k, X, rows):
+        """ hands states X of replicates rows at times k to the reducers """
+        if rows is None: rows = self.rows
+        rows = np.atleast_1d(rows)
+        k = np.zeros(len(rows), dtype=int) + k
+        X = np.atleast_2d(X)
+        for reducer in self.reducers:
+            reducer.update(k, rows, X)
+        for reducer in self.reducers:
+            if reducer.decided(self.rows).all():
+                raise StopSimulation()
+
+    def record(self, k, x, rows=None):
+        """
+        Records state x at output time k. For an ensemble, x is the stack
+        of all replicates, or of replicates rows only.
+        """
+        if self.values is not None:
+            if rows is None:
+                self.values[..., k, :] = self.observe(x)
+            else:
+                self.values[rows, k] = self.observe(x)
+        if self.reducers:
+            self._reduce(k, x, rows)
+
+    def fill(self, k, x, row=None):
+        """ Records a state that stays constant from output time k on """
+        if self.values is not None:
+            if row is None:
+                self.values[k:] = self.observe(x)
+            else:
+                self.values[row, k:] = self.observe(x)
+        if self.reducers:
+            for ki in range(k, self.n_times):
+                self._reduce(ki, x, row)
+
+    def result(self):
+        """
+        recorded values, shape ([n_replicates,] n_times, n_observables),
+        or None if not stored
+        """
+        return self.values
+
+    def get_state(self):
+        """ recorded values and reducer states, for a Checkpoint """
+        return self.values, [reducer.__dict__ for reducer in self.reducers]
+
+    def set_state(self, state):
+        """ restores get_state() in place, keeping the reducer objects """
+        self.values, reducer_states = state
+        for reducer, reducer_state in zip(self.reducers, reducer_states):
+            reducer.__dict__.update(reducer_state)
+
+
+class Checkpoint(object):
+    """
+    Snapshots of an in-flight trajectory, taken at most every interval
+    seconds of wall time and written to path. A solver given a
+    Checkpoint resumes from the snapshot at path if there is one, and
+    the resumed trajectory is identical to an uninterrupted one, as the
+    snapshot includes the state of the random number generator. Use one
+    Checkpoint per trajectory; ssa_direct, ssa_modified_next_reaction
+    and ssa_jit support it. The interval is counted from the start of
+    the solver (see start), not from the creation of the Checkpoint, so
+    tasks queued before they run do not snapshot at once.
+    """
+
+    def __init__(self, path, interval=600.):
+        self.path = path
+        self.interval = interval
+        self.last_save = None
+
+    def start(self):
+        """ starts the interval, called by the solver as it starts """
+        self.last_save = time.time()
+
+    def due(self):
+        """ True if the last snapshot is more than interval seconds old """
+        return time.time() - self.last_save >= self.interval
+
+    def save(self, state):
+        """ writes state, replacing the previous snapshot """
+        with open(self.path+'.tmp', 'wb') as output_file:
+            pickle.dump(state, output_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(self.path+'.tmp', self.path)
+        self.last_save = time.time()
+
+    def load(self):
+        """ the last snapshot, or None if there is none """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as read_file:
+            return pickle.load(read_file)
+
+    def clear(self):
+        """ removes the snapshot, once the trajectory is finished """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def ssa_direct(network, x0, tspan, random_state, recorder=None,
+               checkpoint=None):
+    """
+    Gillespie direct method. Returns the species counts at each time in
+    tspan, shape (len(tspan), n_species), or the values kept by recorder.
+    After each event only the propensities in the dependency graph of
+    the fired reaction are recomputed; the selection itself stays a
+    linear search over all channels. With a Checkpoint, the run is
+    snapshotted periodically and resumes from the last snapshot.
+    """
+    indptr = network.stoichiometry.indptr
+    indices = network.stoichiometry.indices
+    changes = network.stoichiometry.data
+    update = network.propensities.update
+
+    x = network.initial_state(x0)
+    nt = len(tspan)
+    if recorder is None: recorder = Recorder(network, nt)
+    t = tspan[0]
+    k = 0
+    if checkpoint is not None:
+        checkpoint.start()
+        saved = checkpoint.load()
+        if saved is not None:
+            x, t, k, rng_state, recorder_state = saved
+            random_state.set_state(rng_state)
+            recorder.set_state(recorder_state)
+    a = network.propensities(x)
+    while k < nt:
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save((x, t, k, random_state.get_state(),
+                             recorder.get_state()))
+        a0 = a.sum()
+        if a0 <= 0:
+            # nothing can fire, state is constant from here on
+            recorder.fill(k, x)
+            break
+
+        r1, r2 = random_state.random_sample(2)
+        t += -np.log(1. - r1)/a0
+        while k < nt and tspan[k] < t:
+            recorder.record(k, x)
+            k += 1
+        if k == nt: break
+
+        j = np.searchsorted(np.cumsum(a), r2*a0, side='right')
+        j = min(j, network.n_reactions-1)
+        x[indices[indptr[j]:indptr[j+1]]] += changes[indptr[j]:indptr[j+1]]
+        update(a, x, network.update_plan(j))
+
+    return recorder.result()
+
+
+class IndexedPriorityQueue(object):
+    """
+    Binary min-heap of reaction firing times that also tracks the heap
+    position of each reaction, so a single time can be updated in
+    O(log R).
+    """
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.heap = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self.pos = [0]*len(self.keys)
+        for p, i in enumerate(self.heap):
+            self.pos[i] = p
+
+    def top(self):
+        """ Returns (index, key) of the smallest key. """
+        i = self.heap[0]
+        return i, self.keys[i]
+
+    def update(self, i, key):
+        """ Sets the key of index i and restores the heap order. """
+        old = self.keys[i]
+        self.keys[i] = key
+        if key < old: self._sift_up(self.pos[i])
+        else: self._sift_down(self.pos[i])
+
+    def _swap(self, p, q):
+        heap, pos = self.heap, self.pos
+        heap[p], heap[q] = heap[q], heap[p]
+        pos[heap[p]] = p
+        pos[heap[q]] = q
+
+    def _sift_up(self, p):
+        keys, heap = self.keys, self.heap
+        while p > 0:
+            parent = (p - 1) >> 1
+            if keys[heap[p]] < keys[heap[parent]]:
+                self._swap(p, parent)
+                p = parent
+            else: break
+
+    def _sift_down(self, p):
+        keys, heap = self.keys, self.heap
+        n = len(heap)
+        while True:
+            child = 2*p + 1
+            if child >= n: break
+            if child + 1 < n and keys[heap[child+1]] < keys[heap[child]]:
+                child += 1
+            if keys[heap[child]] < keys[heap[p]]:
+                self._swap(p, child)
+                p = child
+            else: break
+
+
+def ssa_next_reaction(network, x0, tspan, random_state, recorder=None):
+    """
+    Gibson-Bruck next reaction method. Firing times are kept in an
+    indexed priority queue and, after each event, only the propensities
+    in the dependency graph of the fired reaction are recomputed, so a
+    step costs O(log R) rather than O(R). Exact, like the direct method.
+    Returns the species counts at each time in tspan.
+    """
+    indptr = network.stoichiometry.indptr
+    indices = network.stoichiometry.indices
+    changes = network.stoichiometry.data
+    graph = network.dependency_graph()
+    single = network.propensities.single
+    exponential = random_state.exponential
+
+    x = network.initial_state(x0)
+    nt = len(tspan)
+    if recorder is None: recorder = Recorder(network, nt)
+    t = tspan[0]
+    k = 0
+
+    a = network.propensities(x).tolist()
+    times = [t + exponential()/ai if ai > 0 else np.inf for ai in a]
+    queue = IndexedPriorityQueue(times)
+
+    while k < nt:
+        mu, t_next = queue.top()
+        while k < nt and tspan[k] < t_next:
+            recorder.record(k, x)
+            k += 1
+        if k == nt: break
+        t = t_next
+
+        x[indices[indptr[mu]:indptr[mu+1]]] += changes[indptr[mu]:indptr[mu+1]]
+
+        for r in graph.indices[graph.indptr[mu]:graph.indptr[mu+1]]:
+            a_new = single(x, r)
+            if a_new <= 0:
+                t_r = np.inf
+            elif r != mu and a[r] > 0:
+                # reuse the pending firing time, rescaled to the new rate
+                t_r = t + (a[r]/a_new)*(queue.keys[r] - t)
+            else:
+                t_r = t + exponential()/a_new
+            a[r] = a_new
+            queue.update(r, t_r)
+
+    return recorder.result()
+
+
+class ChannelStreams(object):
+    """
+    Unit exponential variates for each reaction channel, each channel
+    drawing from its own RandomState, in blocks. The variates of a
+    channel do not depend on how often the other channels fire.
+    """
+
+    def __init__(self, random_states, block=64):
+        self.random_states = list(random_states)
+        self.block = block
+        self.buffers = [[] for rs in self.random_states]
+
+    @classmethod
+    def from_random_state(cls, random_state, n_channels, block=64):
+        """ Channel streams seeded from random_state """
+        seeds = random_state.randint(0, 2**31, size=(n_channels, 2))
+        return cls([np.random.RandomState(seed) for seed in seeds], block)
+
+    def draw(self, r):
+        """ Next unit exponential variate of channel r """
+        buffer = self.buffers[r]
+        if not buffer:
+            # reversed, so that pop() returns the block in order
+            buffer.extend(
+                self.random_states[r].exponential(size=self.block)[::-1])
+        return buffer.pop()
+
+
+def ssa_modified_next_reaction(network, x0, tspan, random_state,
+                               recorder=None, checkpoint=None):
+    """
+    Modified next reaction method of Anderson (J Chem Phys 127, 214107,
+    2007). Returns the species counts at each time in tspan. Exact, like
+    the direct method.
+
+    Each reaction channel is a unit-rate Poisson process run at internal
+    time T_r = integral of a_r dt, with firing times drawn from its own
+    stream (see ChannelStreams), whose seeds are drawn from random_state.
+    Simulations given the same seed therefore share the noise of each
+    channel, even if propensities differ: run WT and knockouts with the
+    same seed for common random numbers (Rathinam et al, Anderson 2012),
+    which correlates their outcomes and reduces the variance of their
+    differences. Takes a Checkpoint as ssa_direct.
+    """
+    indptr = network.stoichiometry.indptr
+    indices = network.stoichiometry.indices
+    changes = network.stoichiometry.data
+    graph = network.dependency_graph()
+    single = network.propensities.single
+    streams = ChannelStreams.from_random_state(random_state,
+                                               network.n_reactions)
+
+    x = network.initial_state(x0)
+    nt = len(tspan)
+    if recorder is None: recorder = Recorder(network, nt)
+    t = tspan[0]
+    k = 0
+
+    # internal time T of each channel at its last update s, and the
+    # internal time P of its next firing
+    a = network.propensities(x).tolist()
+    T = [0.]*network.n_reactions
+    s = [t]*network.n_reactions
+    P = [streams.draw(r) for r in range(network.n_reactions)]
+    queue = IndexedPriorityQueue([t + P[r]/a[r] if a[r] > 0 else np.inf
+                                  for r in range(network.n_reactions)])
+    if checkpoint is not None:
+        checkpoint.start()
+        saved = checkpoint.load()
+        if saved is not None:
+            x, t, k, a, T, s, P, queue, streams, recorder_state = saved
+            recorder.set_state(recorder_state)
+
+    while k < nt:
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save((x, t, k, a, T, s, P, queue, streams,
+                             recorder.get_state()))
+        mu, t_next = queue.top()
+        while k < nt and tspan[k] < t_next:
+            recorder.record(k, x)
+            k += 1
+        if k == nt: break
+        t = t_next
+
+        x[indices[indptr[mu]:indptr[mu+1]]] += changes[indptr[mu]:indptr[mu+1]]
+        P[mu] += streams.draw(mu)
+
+        for r in graph.indices[graph.indptr[mu]:graph.indptr[mu+1]]:
+            T[r] += a[r]*(t - s[r])
+            s[r] = t
+            a[r] = single(x, r)
+            queue.update(r, t + (P[r] - T[r])/a[r] if a[r] > 0 else np.inf)
+
+    return recorder.result()
+
+
+def tau_leaping(network, x0, tspan, random_state, epsilon=0.03,
+                n_critical=10, ssa_factor=10., ssa_steps=100, recorder=None):
+    """
+    Adaptive tau-leaping of Cao, Gillespie and Petzold (J Chem Phys 124,
+    044109, 2006). Returns the species counts at each time in tspan.
+
+    Reactions that could exhaust a reactant within n_critical firings are
+    critical and fire at most once per leap, as in the SSA. The leap size
+    for the rest bounds the expected relative change of every consumed
+    species by epsilon, which is the error-control parameter. When the
+    leap would be shorter than ssa_factor/a0 the solver takes ssa_steps
+    exact direct-method steps instead.
+
+    The factor g of the bound follows the highest order of reaction of
+    each species (see _highest_order_g), with the order of a reaction
+    taken as the number of molecules it consumes. For the Hill and
+    Michaelis-Menten propensities of the Gonze model this is an
+    approximation: every reaction consumes at most one molecule, so
+    g = 1, although those propensities are not first order in the
+    species they read.
+    """
+    S = network.stoichiometry
+    ST = S.T.tocsr()
+    ns = network.n_species
+
+    # consumption of each species by each reaction, for critical reactions
+    species_S = S[:, :ns].tocsr()
+    consumed = (-species_S).multiply(species_S < 0).tocsr()
+    consumes = np.diff(consumed.indptr) > 0
+    starts = consumed.indptr[:-1][consumes]
+
+    # tau selection over consumed species: highest order of reaction of
+    # each, and its largest coefficient in a reaction of that order
+    species_ST = species_S.T.tocsr()
+    species_ST2 = species_ST.multiply(species_ST).tocsr()
+    reactant = np.asarray(consumed.sum(0)).ravel() > 0
+    order = np.asarray(consumed.sum(1)).ravel()
+    hor = np.zeros(ns)
+    coefficient = np.zeros(ns)
+    pairs = consumed.tocoo()
+    for r, i, c in zip(pairs.row, pairs.col, pairs.data):
+        if (order[r], c) > (hor[i], coefficient[i]):
+            hor[i], coefficient[i] = order[r], c
+    hor = hor[reactant]
+    coefficient = coefficient[reactant]
+
+    x = network.initial_state(x0)
+    nt = len(tspan)
+    if recorder is None: recorder = Recorder(network, nt)
+    t = tspan[0]
+    k = 0
+    while k < nt:
+        while k < nt and tspan[k] <= t:
+            recorder.record(k, x)
+            k += 1
+        if k == nt: break
+
+        a = network.propensities(x)
+        a0 = a.sum()
+        if a0 <= 0:
+            recorder.fill(k, x)
+            break
+
+        # firings left before a reactant runs out
+        L = np.empty(network.n_reactions)
+        L.fill(np.inf)
+        L[consumes] = np.minimum.reduceat(
+            x[consumed.indices]//consumed.data, starts)
+        critical = (a > 0) & (L < n_critical)
+        a_nc = np.where(critical, 0., a)
+
+        mu = np.abs(species_ST.dot(a_nc)[reactant])
+        sigma2 = species_ST2.dot(a_nc)[reactant]
+        g = _highest_order_g(hor, coefficient, x[:ns][reactant])
+        bound = np.maximum(epsilon*x[:ns][reactant]/g, 1.)
+        with np.errstate(divide='ignore'):
+            tau1 = np.min(np.hstack([bound/mu, bound**2/sigma2, np.inf]))
+
+        if tau1 < ssa_factor/a0:
+            # leaping would gain little, take exact steps
+            for step in range(ssa_steps):
+                r1, r2 = random_state.random_sample(2)
+                t_event = t - np.log(1. - r1)/a0
+                while k < nt and tspan[k] < t_event:
+                    recorder.record(k, x)
+                    k += 1
+                if k == nt: break
+                t = t_event
+                j = np.searchsorted(np.cumsum(a), r2*a0, side='right')
+                j = min(j, network.n_reactions-1)
+                x[S.indices[S.indptr[j]:S.indptr[j+1]]] += \
+                    S.data[S.indptr[j]:S.indptr[j+1]]
+                a = network.propensities(x)
+                a0 = a.sum()
+                if a0 <= 0: break
+            continue
+
+        a0_c = a[critical].sum()
+        while True:
+            tau2 = (random_state.exponential()/a0_c if a0_c > 0
+                    else np.inf)
+            fire_critical = tau2 <= tau1
+            tau = tau2 if fire_critical else tau1
+            if t + tau >= tspan[k]:
+                # stop the leap at the next output time
+                tau = tspan[k] - t
+                fire_critical = False
+
+            firings = random_state.poisson(a_nc*tau).astype(float)
+            if fire_critical:
+                a_c = np.where(critical, a, 0.)
+                j = np.searchsorted(np.cumsum(a_c),
+                                    random_state.random_sample()*a0_c,
+                                    side='right')
+                firings[min(j, network.n_reactions-1)] += 1
+            x_new = x + ST.dot(firings)
+            if np.all(x_new[:ns] >= 0): break
+            # a species went negative, retry with a shorter leap
+            tau1 = tau1/2.
+
+        x = x_new
+        t = tspan[k] if t + tau >= tspan[k] else t + tau
+
+    return recorder.result()
+
+
+def _highest_order_g(hor, coefficient, x):
+    """
+    The g of each species in the tau selection of Cao et al. (2006, eq.
+    27), from its highest order of reaction hor, the largest number of
+    its molecules consumed by a reaction of that order, and its count x.
+    Orders above three use g = hor.
+    """
+    inverse1 = 1./np.maximum(x - 1., 1.)
+    inverse2 = 1./np.maximum(x - 2., 1.)
+    g = hor.astype(float)
+    g = np.where((hor == 2) & (coefficient == 2), 2. + inverse1, g)
+    g = np.where((hor == 3) & (coefficient == 2), 1.5*(2. + inverse1), g)
+    g = np.where((hor == 3) & (coefficient == 3),
+                 3. + inverse1 + 2.*inverse2, g)
+    return g
+
+
+def _apply_reactions(X, rows, reactions, S):
+    """
+    Fires reactions[i] in replicate rows[i] of the state stack X, for
+    the CSR stoichiometry S.
+    """
+    starts = S.indptr[reactions]
+    counts = S.indptr[reactions+1] - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts,
+                                                  counts)
+    entries = np.repeat(starts, counts) + offsets
+    X[np.repeat(rows, counts), S.indices[entries]] += S.data[entries]
+
+
+def ssa_direct_ensemble(network, X0, tspan, random_state, recorder=None):
+    """
+    Direct method for N independent replicates advanced together. X0 is
+    a stack of initial species counts, shape (N, n_species). At each
+    pass the propensities of all replicates are evaluated as one array
+    and every replicate fires its own next event. Returns the species
+    counts, shape (N, len(tspan), n_species).
+    """
+    S = network.stoichiometry
+
+    X = network.initial_state(np.atleast_2d(X0))
+    N = X.shape[0]
+    nt = len(tspan)
+    if recorder is None: recorder = Recorder(network, nt, n_replicates=N)
+    t = np.empty(N)
+    t.fill(tspan[0])
+    k = np.zeros(N, dtype=int)
+    active = np.arange(N)
+    while len(active):
+        A = network.propensities(X[active])
+        a0 = A.sum(1)
+
+        # replicates where nothing can fire stay constant
+        stuck = a0 <= 0
+        for i in active[stuck]:
+            recorder.fill(k[i], X[i], i)
+        active, A, a0 = active[~stuck], A[~stuck], a0[~stuck]
+
+        r = random_state.random_sample((len(active), 2))
+        t_new = t[active] - np.log(1. - r[:, 0])/a0
+        while True:
+            ka = k[active]
+            record = (ka < nt) & (tspan[np.minimum(ka, nt-1)] < t_new)
+            if not record.any(): break
+            rows = active[record]
+            recorder.record(ka[record], X[rows], rows)
+            k[rows] += 1
+
+        fire = k[active] < nt
+        j = (np.cumsum(A[fire], 1) > (r[fire, 1]*a0[fire])[:, None]).argmax(1)
+        _apply_reactions(X, active[fire], j, S)
+        t[active] = t_new
+        active = active[fire]
+
+    return recorder.result()
+
+
+def cle_ensemble(network, X0, tspan, random_state, dt=0.01,
+                 method='euler', recorder=None):
+    """
+    Chemical Langevin equation for N replicates, X0 of shape
+    (N, n_species). Each reaction channel j contributes
+    a_j(x) dt + sqrt(a_j(x)) dW_j along its stoichiometry. Steps are at
+    most dt and land on every time in tspan. Counts are real-valued and
+    kept non-negative. Returns shape (N, len(tspan), n_species).
+
+    method : 'euler' or 'drift_corrected'
+        'euler' is Euler-Maruyama. 'drift_corrected' is drift-corrected
+        Euler-Maruyama: the drift takes a trapezoidal predictor-corrector
+        step, while the noise is the Ito term at the start of the step,
+        as in 'euler'. It is not a stochastic Heun scheme and its strong
+        order is 0.5, as for 'euler'. It only reduces the drift error,
+        which helps at large volume where the drift dominates.
+    """
+    S = network.stoichiometry[:, :network.n_species].tocsr()
+    ST = S.T.tocsr()
+
+    def rates(X):
+        """ propensities, clipped at zero, for species stack X """
+        return np.maximum(network.propensities(network.initial_state(X)), 0.)
+
+    X = np.array(np.atleast_2d(X0), dtype=float)
+    N = X.shape[0]
+    nt = len(tspan)
+    if recorder is None: recorder = Recorder(network, nt, n_replicates=N)
+    recorder.record(0, X)
+    for ti in range(1, nt):
+        interval = tspan[ti] - tspan[ti-1]
+        steps = int(np.ceil(interval/dt - 1E-9))
+        h = interval/steps
+        for step in range(steps):
+            A = rates(X)
+            noise = np.sqrt(A*h)*random_state.standard_normal(A.shape)
+            if method == 'euler':
+                X = X + ST.dot((A*h + noise).T).T
+            elif method == 'drift_corrected':
+                X_pred = np.maximum(X + ST.dot((A*h + noise).T).T, 0.)
+                A_pred = rates(X_pred)
+                X = X + ST.dot((0.5*(A + A_pred)*h + noise).T).T
+            else:
+                raise ValueError("Unknown CLE method '%s'." % method)
+            X = np.maximum(X, 0.)
+        recorder.record(ti, X)
+
+    return recorder.result()
+
+
+def cle(network, x0, tspan, random_state, dt=0.01, method='euler',
+        recorder=None):
+    """ Chemical Langevin equation for one trajectory, see cle_ensemble """
+    if recorder is None: recorder = Recorder(network, len(tspan))
+    return cle_ensemble(network, np.atleast_2d(x0), tspan, random_state,
+                        dt=dt, method=method, recorder=recorder)
+
+
+def hybrid(network, x0, tspan, random_state, dt=0.1, fast_events=10.,
+           min_count=100., recorder=None):
+    """
+    Hybrid chemical Langevin / SSA method (after Salis and Kaznessis,
+    J Chem Phys 122, 054103, 2005). Returns the species counts at each
+    time in tspan.
+
+    A reaction is fast while it would fire at least fast_events times in
+    a step of dt and every species it changes has at least min_count
+    copies per unit of change; the fast reactions advance by the CLE,
+    the others fire one at a time as in the SSA. The slow reactions fire
+    when the integral of their total propensity, which changes with the
+    fast species, reaches an exponential draw; steps are shortened to
+    land on those firings and on every time in tspan. The partition is
+    recomputed from the propensities at every step, so reactions move
+    between the sets as counts rise and fall over the cycle. Counts are
+    real-valued while fast reactions act on them.
+    """
+    S = network.stoichiometry
+    ns = network.n_species
+    species_S = S[:, :ns].tocsr()
+    species_ST = species_S.T.tocsr()
+
+    # copies per unit of change of each species changed by each reaction
+    changed = abs(species_S).tocsr()
+    changes = np.diff(changed.indptr) > 0
+    starts = changed.indptr[:-1][changes]
+
+    x = network.initial_state(x0)
+    nt = len(tspan)
+    if recorder is None: recorder = Recorder(network, nt)
+    t = tspan[0]
+    k = 0
+    integral = 0.
+    target = random_state.exponential()
+    while k < nt:
+        while k < nt and tspan[k] <= t:
+            recorder.record(k, x)
+            k += 1
+        if k == nt: break
+
+        a = np.maximum(network.propensities(x), 0.)
+        room = np.empty(network.n_reactions)
+        room.fill(np.inf)
+        room[changes] = np.minimum.reduceat(
+            x[changed.indices]/changed.data, starts)
+        fast = (a*dt >= fast_events) & (room >= min_count)
+        a_slow = np.where(fast, 0., a)
+        a0_slow = a_slow.sum()
+        if a0_slow <= 0 and not fast.any():
+            # nothing can fire, state is constant from here on
+            recorder.fill(k, x)
+            break
+
+        h = min(dt, tspan[k] - t)
+        fire = a0_slow*h >= target - integral
+        if fire:
+            h = (target - integral)/a0_slow
+
+        if fast.any():
+            a_fast = np.where(fast, a, 0.)
+            noise = np.sqrt(a_fast*h)*random_state.standard_normal(
+                network.n_reactions)
+            counts = np.maximum(x[:ns] + species_ST.dot(a_fast*h + noise), 0.)
+            x = network.initial_state(counts)
+        t += h
+
+        if fire:
+            j = np.searchsorted(np.cumsum(a_slow),
+                                random_state.random_sample()*a0_slow,
+                                side='right')
+            j = min(j, network.n_reactions-1)
+            x[S.indices[S.indptr[j]:S.indptr[j+1]]] += \
+                S.data[S.indptr[j]:S.indptr[j+1]]
+            if np.any(x[:ns] < 0):
+                # a fractional count was consumed
+                x = network.initial_state(np.maximum(x[:ns], 0.))
+            integral = 0.
+            target = random_state.exponential()
+        else:
+            integral += a0_slow*h
+
+    return recorder.result()
+
+
+solvers = {
+    'direct'      : ssa_direct,
+    'nrm'         : ssa_next_reaction,
+    'mnrm'        : ssa_modified_next_reaction,
+    'jit'         : ssa_jit,
+    'tau_leaping' : tau_leaping,
+    'cle'         : cle,
+    'hybrid'      : hybrid,
+    }
+
+# solvers that advance a stack of replicates together
+ensemble_solvers = {
+    'direct' : ssa_direct_ensemble,
+    'cle'    : cle_ensemble,
+    }
+
+
+def _start_reducers(network, tspan, n_replicates, reducers, record):
+    """ starts reducers, a dict of Reducer, for a simulation """
+    if not (record or reducers):
+        raise ValueError("Nothing to keep: record is False and there "
+                         "are no reducers.")
+    for reducer in (reducers or {}).values():
+        reducer.start(network, tspan, n_replicates)
+    return list((reducers or {}).values())
+
+
+def _reductions(reducers, trajectories, record):
+    """ the return value of a simulation with reducers """
+    if reducers is None:
+        return trajectories
+    results = dict((name, reducer.result())
+                   for name, reducer in reducers.items())
+    if record:
+        results['trajectories'] = trajectories
+    return results
+
+
+def simulate(network, tspan, number_of_trajectories=1, seed=None,
+             show_labels=False, solver='direct', x0=None, observables=None,
+             stride=1, reducers=None, record=True, **solver_options):
+    """
+    Simulates network from x0 (default network.x0), returning a list of
+    trajectories in the format of gillespy.Model.run. See InProcessModel.
+    """
+    if x0 is None: x0 = network.x0
+    tspan = np.asarray(tspan, dtype=float)[::stride]
+    random_state = check_random_state(seed)
+    started = _start_reducers(network, tspan, number_of_trajectories,
+                              reducers, record)
+
+    trajectories = []
+    for i in range(number_of_trajectories):
+        recorder = Recorder(network, len(tspan), observables,
+                            reducers=started, store=record, replicate=i)
+        try:
+            sol = solvers[solver](network, x0, tspan, random_state,
+                                  recorder=recorder, **solver_options)
+        except StopSimulation:
+            sol = recorder.result()
+        if record:
+            trajectories.append(_trajectory(tspan, sol, recorder.labels,
+                                            show_labels))
+    return _reductions(reducers, trajectories, record)
+
+
+def _trajectory(tspan, sol, labels, show_labels):
+    """ one trajectory in the format of gillespy.Model.run """
+    if show_labels:
+        traj = OrderedDict([('time', tspan)])
+        for oi, name in enumerate(labels):
+            traj[name] = sol[:, oi]
+        return traj
+    return np.hstack([tspan[:, None], sol])
+
+
+def replay(network, tspan, trajectories, show_labels=False,
+           observables=None, stride=1, reducers=None, record=True):
+    """
+    Passes trajectories of an external simulator, arrays of
+    [time, species...] at the times tspan as returned by gillespy with
+    show_labels False, through a Recorder. The result is that of
+    simulate with the same options, so StochKit runs accept observables,
+    stride and reducers too.
+    """
+    tspan = np.asarray(tspan, dtype=float)[::stride]
+    started = _start_reducers(network, tspan, len(trajectories), reducers,
+                              record)
+
+    results = []
+    for i, traj in enumerate(trajectories):
+        states = network.initial_state(np.asarray(traj)[::stride, 1:])
+        recorder = Recorder(network, len(tspan), observables,
+                            reducers=started, store=record, replicate=i)
+        try:
+            for k, x in enumerate(states):
+                recorder.record(k, x)
+        except StopSimulation:
+            pass
+        if record:
+            results.append(_trajectory(tspan, recorder.result(),
+                                       recorder.labels, show_labels))
+    return _reductions(reducers, results, record)
+
+
+def stochkit_seed(seed):
+    """
+    Integer seed for StochKit, for any seed taken by check_random_state.
+    """
+    if seed is None or isinstance(seed, (int, long, np.integer)):
+        return seed
+    return int(check_random_state(seed).randint(2**31 - 1))
+
+
+def simulate_ensemble(network, tspan, initial_states=None,
+                      number_of_trajectories=1, seed=None, solver='direct',
+                      observables=None, stride=1, reducers=None, record=True,
+                      **solver_options):
+    """
+    Simulates a stack of replicates, shape (N, len(tspan), n_observables).
+    See InProcessModel.run_ensemble.
+    """
+    if initial_states is None:
+        initial_states = np.tile(network.x0, (number_of_trajectories, 1))
+    initial_states = np.atleast_2d(initial_states)
+    tspan = np.asarray(tspan, dtype=float)[::stride]
+    started = _start_reducers(network, tspan, len(initial_states), reducers,
+                              record)
+    recorder = Recorder(network, len(tspan), observables,
+                        n_replicates=len(initial_states), reducers=started,
+                        store=record)
+    try:
+        sol = ensemble_solvers[solver](network, initial_states, tspan,
+                                       check_random_state(seed),
+                                       recorder=recorder, **solver_options)
+    except StopSimulation:
+        sol = recorder.result()
+    return _reductions(reducers, sol, record)
+
+
+class InProcessModel(object):
+    """
+    Mixin for gillespy models that simulates them in-process. Place it
+    before gsp.Model in the bases; solver='stochkit' still runs the model
+    through gillespy.
+    """
+
+    def network(self):
+        """ The ReactionNetwork of this model, built on first use. """
+        if getattr(self, '_network', None) is None:
+            self._network = ReactionNetwork.from_gillespy(self)
+        return self._network
+
+    def run(self, number_of_trajectories=1, seed=None, show_labels=False,
+            solver='stochkit', **solver_options):
+        """
+        Simulates the model over self.tspan. Arguments follow
+        gillespy.Model.run: the return value is a list of trajectories,
+        each an array of [time, species...], or a dict keyed by species
+        name if show_labels is True.
+
+        solver selects an entry of stoch_engine.solvers ('direct', the
+        Gillespie direct method, 'nrm', the next reaction method,
+        'mnrm', the modified next reaction method for common random
+        numbers, 'jit', the direct method compiled by numba (see
+        jit_ssa.py), 'tau_leaping', 'cle', the chemical Langevin
+        equation, or 'hybrid', the CLE for fast reactions and the SSA
+        for slow ones), or 'stochkit' (the default) to run through
+        gillespy. benchmark_solvers.py compares their speed; StochKit
+        stays the default until an in-process solver is measured to be
+        faster on the SCN models.
+
+        The in-process solvers also take observables, to record only
+        some species or linear combinations of them in place of all
+        species (see Recorder), and stride, to record every stride-th
+        time of self.tspan only. reducers, a dict of stoch_engine.Reducer
+        (see reducers.py), summarizes each trajectory as it runs; run
+        then returns a dict of their results by name, plus the
+        trajectories under 'trajectories' unless record is False. A
+        reducer may end the run early once its outcome is decided (e.g.
+        reducers.SynchronyStop); without one, every run covers the full
+        self.tspan. With 'stochkit', these options are applied to the
+        StochKit trajectories afterwards (see replay).
+        """
+        if solver == 'stochkit':
+            options = dict((key, solver_options.pop(key))
+                           for key in ('observables', 'stride', 'reducers',
+                                       'record')
+                           if key in solver_options)
+            trajectories = super(InProcessModel, self).run(
+                number_of_trajectories=number_of_trajectories,
+                seed=stochkit_seed(seed), show_labels=False,
+                **solver_options)
+            return replay(self.network(), self.tspan, trajectories,
+                          show_labels, **options)
+
+        return simulate(self.network(), self.tspan, number_of_trajectories,
+                        seed, show_labels, solver, **solver_options)
+
+    def run_ensemble(self, initial_states=None, number_of_trajectories=1,
+                     seed=None, solver='direct', **solver_options):
+        """
+        Simulates a batch of replicates in one vectorized pass. Returns
+        the species counts at each time of self.tspan, shape
+        (N, len(tspan), n_species), or the observables if given, or the
+        reductions if reducers are given (see run).
+
+        initial_states : optional array, shape (N, n_species)
+            initial species counts of each replicate. Defaults to the
+            model's initial values, repeated number_of_trajectories times.
+        solver : str
+            an entry of stoch_engine.ensemble_solvers.
+        """
+        return simulate_ensemble(self.network(), self.tspan, initial_states,
+                                 number_of_trajectories, seed, solver,
+                                 **solver_options)
@@ -19,7 +19,9 @@ def oneshot_params_mics(kav):
     can be done in parallel. kav, as before is the ratio of avp to vip signal 
     strength.
     """
-    
+    # cell counts, as in simulate_changing_parameter.py
+    AVPcells = 20; VIPcells = 20; NAVcells = 20
+
     from itertools import combinations
     import numpy as np
     import minepy as mp
@@ -30,10 +32,20 @@ def oneshot_params_mics(kav):
         returns the MIC values for one set of the SCN trajectories in question
         """
 
-        avpvipsol = trajectories[:, 1:(160+1)]
-        navsol = trajectories[:, (160+1):]
-
-        per2 = np.hstack([avpvipsol[:, ::4], navsol[:, ::3]])
+        nsig = AVPcells+VIPcells
+        if trajectories.shape[1] == nsig+NAVcells+1:
+            # recorded with observables='per2', one column per cell
+            per2 = trajectories[:, 1:]
+        elif trajectories.shape[1] == 4*nsig+3*NAVcells+1:
+            avpvipsol = trajectories[:, 1:(4*nsig+1)]
+            navsol = trajectories[:, (4*nsig+1):]
+            per2 = np.hstack([avpvipsol[:, ::4], navsol[:, ::3]])
+        else:
+            raise ValueError("Trajectories have %d columns, expected %d "
+                             "(per2) or %d (all species) for %d AVP/VIP "
+                             "and %d NAV cells." % (trajectories.shape[1],
+                             nsig+NAVcells+1, 4*nsig+3*NAVcells+1, nsig,
+                             NAVcells))
         numcells = per2.shape[1]
 
         # set up mic calculator
@@ -97,6 +109,8 @@ def oneshot_celltypes_mics(navp):
     can be done in parallel. navp is the number of AVP trajectories.
     """
     nvip = 40-navp
+    # cell counts, as in simulate_changing_celltypes.py
+    AVPcells = navp; VIPcells = nvip; NAVcells = 20
 
     from itertools import combinations
     import numpy as np
@@ -108,10 +122,20 @@ def oneshot_celltypes_mics(navp):
         returns the MIC values for one set of the SCN trajectories in question
         """
 
-        avpvipsol = trajectories[:, 1:(160+1)]
-        navsol = trajectories[:, (160+1):]
-
-        per2 = np.hstack([avpvipsol[:, ::4], navsol[:, ::3]])
+        nsig = AVPcells+VIPcells
+        if trajectories.shape[1] == nsig+NAVcells+1:
+            # recorded with observables='per2', one column per cell
+            per2 = trajectories[:, 1:]
+        elif trajectories.shape[1] == 4*nsig+3*NAVcells+1:
+            avpvipsol = trajectories[:, 1:(4*nsig+1)]
+            navsol = trajectories[:, (4*nsig+1):]
+            per2 = np.hstack([avpvipsol[:, ::4], navsol[:, ::3]])
+        else:
+            raise ValueError("Trajectories have %d columns, expected %d "
+                             "(per2) or %d (all species) for %d AVP/VIP "
+                             "and %d NAV cells." % (trajectories.shape[1],
+                             nsig+NAVcells+1, 4*nsig+3*NAVcells+1, nsig,
+                             NAVcells))
         numcells = per2.shape[1]
 
         # set up mic calculator
@@ -33,10 +33,9 @@ from local_models.gonze_model import y0in, param, ODEmodel, EqCount
 
 # find original period
 single_osc = lc.Oscillator(ODEmodel(), param, y0=np.ones(EqCount))
-ts, sol = single_osc.int_odes(500)
-single_osc.approx_y0_T(trans=2000)
+# y0, period and limit cycle, computed once and then read from the cache
+single_osc.cached_limit_cycle('data/limit_cycles', trans=2000)
 wt_T = single_osc.T
-single_osc.limit_cycle()
 
 # number of each celltype
 # these and the kav are hard-coded into the model
@@ -44,18 +43,16 @@ AVPcells = 53; VIPcells=27; NAVcells = 40
 totcells = AVPcells+VIPcells+NAVcells
 
 # initial phases
-init_conditions_AV  = [single_osc.lc(wt_T*np.random.rand()) 
-                        for i in range(AVPcells+VIPcells)]
-init_conditions_NAV = [single_osc.lc(wt_T*np.random.rand())[:-1]
-                        for i in range(NAVcells)]
-
-y0_random = np.hstack(init_conditions_AV+init_conditions_NAV)
+from local_models.scn_model import random_phase_y0
+y0_random = random_phase_y0(single_osc, AVPcells, VIPcells, NAVcells)
 # so that figure is identical use the one actually generated
 
 
 
 # switch to the multicellular stochastic model
-from local_models.stoch_model_final import param, GonzeModelManyCells
+from local_models.stoch_model_final import (param, GonzeModelManyCells,
+                                            compile_model)
+from local_models.seeding import SeedTree
 
 # note that these relative strengths only are about IN THE ABSENCE OF THE OTHER
 
@@ -185,29 +182,31 @@ except IOError:
     wt_trajectories = []
     avp_trajectories = []
     vip_trajectories = []
+    compiled = compile_model(parameter_values=param)
+    # independent streams for the initial phases and each simulation
+    seeds = SeedTree(0)
+    # random initial phases of every replicate
+    initial_values = random_phase_y0(
+        single_osc, AVPcells, VIPcells, NAVcells,
+        [seeds.child(tn, 'initial').random_state() for tn in range(100)])
     for tn in range(100):
         print tn,
-        # get random initial condition
-        # initial phases
-        init_conditions_AV  = [single_osc.lc(wt_T*np.random.rand()) 
-                                for i in range(AVPcells+VIPcells)]
-        init_conditions_NAV = [single_osc.lc(wt_T*np.random.rand())[:-1]
-                                for i in range(NAVcells)]
-        y0_random = np.hstack(init_conditions_AV+init_conditions_NAV)
+        y0_random = initial_values[tn]
 
         # do the simulation
-        model = GonzeModelManyCells(param, initial_values=y0_random)
-        wt_trajectories.append(model.run(show_labels=False, seed=0))
+        wt_trajectories.append(compiled.run(y0_random, show_labels=False,
+                                seed=seeds.child(tn, 'wt'), observables='per2',
+                                solver='stochkit'))
 
         # avp bmalko
-        avp_model = GonzeModelManyCells(param, bmalko='AVP', 
-                                        initial_values=y0_random)
-        avp_trajectories.append(avp_model.run(show_labels=False, seed=0))
+        avp_trajectories.append(compiled.run(y0_random, bmalko='AVP',
+                                show_labels=False, seed=seeds.child(tn, 'avp'),
+                                observables='per2', solver='stochkit'))
 
         # vip bmalko
-        vip_model = GonzeModelManyCells(param, bmalko='VIP', 
-                                        initial_values=y0_random)
-        vip_trajectories.append(vip_model.run(show_labels=False, seed=0))
+        vip_trajectories.append(compiled.run(y0_random, bmalko='VIP',
+                                show_labels=False, seed=seeds.child(tn, 'vip'),
+                                observables='per2', solver='stochkit'))
 
     # save results
     with open("data/wt_final.pickle", "wb") as output_file:
@@ -236,10 +235,13 @@ except IOError:
         returns the MIC values for one set of the SCN trajectories in question
         """
 
-        avpvipsol = trajectories[:, 1:(160+1)]
-        navsol = trajectories[:, (160+1):]
-
-        per2 = np.hstack([avpvipsol[:, ::4], navsol[:, ::3]])
+        if trajectories.shape[1] == AVPcells+VIPcells+NAVcells+1:
+            # recorded with observables='per2', one column per cell
+            per2 = trajectories[:, 1:]
+        else:
+            avpvipsol = trajectories[:, 1:(160+1)]
+            navsol = trajectories[:, (160+1):]
+            per2 = np.hstack([avpvipsol[:, ::4], navsol[:, ::3]])
         numcells = per2.shape[1]
 
         # set up mic calculator
@@ -18,10 +18,9 @@ from local_models.gonze_model import param, ODEmodel, EqCount
 
 # find original period
 single_osc = lc.Oscillator(ODEmodel(), param, y0=np.ones(EqCount))
-ts, sol = single_osc.int_odes(500)
-single_osc.approx_y0_T(trans=2000)
+# y0, period and limit cycle, computed once and then read from the cache
+single_osc.cached_limit_cycle('data/limit_cycles', trans=2000)
 wt_T = single_osc.T
-single_osc.limit_cycle()
 
 # number of each celltype
 AVPcells = 20; VIPcells=20; NAVcells = 20
@@ -29,7 +28,39 @@ totcells = AVPcells+VIPcells+NAVcells
 
 # perform sim ulation
 # switch to the many cell model
-from local_models.stoch_multi_params import param, GonzeModelManyCells
+from local_models.stoch_multi_params import param, compile_model
+from local_models.scn_model import random_phase_y0
+from local_models.ensemble_runner import EnsembleRunner
+from local_models.seeding import SeedTree
+
+# worker processes for the simulations, None uses all cores
+processes = None
+
+# seconds between snapshots of each trajectory in progress, None for none.
+# Finished tasks are always kept, so an interrupted sweep resumes when the
+# script is run again.
+checkpoint_interval = None
+
+# all random streams (initial phases, simulations) derive from this seed
+root_seed = 0
+seeds = SeedTree(root_seed)
+
+# stochastic solver: 'stochkit' as in the original sweeps, or one of the
+# in-process solvers of local_models/stoch_engine.py (see
+# benchmark_solvers.py for their speed)
+solver = 'stochkit'
+
+# common random numbers: WT and knockouts of a replicate share the noise
+# of each reaction channel, for paired comparisons in statistical_tests.py.
+# This needs the modified next reaction method, which replaces solver and
+# runs at roughly half the speed of the in-process direct method.
+common_random_numbers = False
+if common_random_numbers: solver = 'mnrm'
+
+# simulate the replicates of each (level, genotype) together, in one
+# vectorized pass of an ensemble solver. Needs solver = 'direct' or 'cle'
+# and no common random numbers or checkpoints.
+batch = False
 
 def load_trajectories(kav):
     """
@@ -52,54 +83,34 @@ def load_trajectories(kav):
             'avp': avp_trajectories,
             'vip': vip_trajectories}
 
-def simulate_trajectories(kav):
+def simulate_trajectories(kavs, replicates=100):
     """
-    Simulates and saves desired trajectories.
+    Simulates and saves desired trajectories. The (kav, replicate,
+    genotype) simulations are run in parallel.
     """
-    print "Simulating "+str(kav)
-    wt_trajectories = []
-    avp_trajectories = []
-    vip_trajectories = []
-    for tn in range(100):
-        # get random initial condition
-        # initial phases
-        init_conditions_AV  = [single_osc.lc(wt_T*np.random.rand()) 
-                                for i in range(AVPcells+VIPcells)]
-        init_conditions_NAV = [single_osc.lc(wt_T*np.random.rand())[:-1]
-                                for i in range(NAVcells)]
-        y0_random = np.hstack(init_conditions_AV+init_conditions_NAV)
-
-        # do the simulation
-        model = GonzeModelManyCells(param, kav=kav, 
-            initial_values=y0_random)
-        wt_trajectories.append(model.run(show_labels=False, seed=0))
-
-        # avp bmalko
-        avp_model = GonzeModelManyCells(param, bmalko='AVP', kav=kav, 
-            initial_values=y0_random)
-        avp_trajectories.append(avp_model.run(show_labels=False, seed=0))
-
-        # vip bmalko
-        vip_model = GonzeModelManyCells(param, bmalko='VIP', kav=kav, 
-            initial_values=y0_random)
-        vip_trajectories.append(vip_model.run(show_labels=False, seed=0))
-
-    # save results
-    with open("Data/params/wt_"+str(kav)+".pickle", "wb") as output_file:
-            pickle.dump(wt_trajectories, output_file)
-    with open("Data/params/avp_"+str(kav)+".pickle", "wb") as output_file:
-            pickle.dump(avp_trajectories, output_file)
-    with open("Data/params/vip_"+str(kav)+".pickle", "wb") as output_file:
-            pickle.dump(vip_trajectories, output_file)
-
-    return {'wt': wt_trajectories,
-            'avp': avp_trajectories,
-            'vip': vip_trajectories}
+    print "Simulating "+str(kavs)
+    # random initial conditions, shared by the genotypes of a replicate,
+    # and the simulations each draw from their own stream of seeds
+    initial_values = {}
+    for kav in kavs:
+        initial_values[kav] = random_phase_y0(
+            single_osc, AVPcells, VIPcells, NAVcells,
+            [seeds.child(kav, tn, 'initial').random_state()
+             for tn in range(replicates)])
+
+    runner = EnsembleRunner(compile_model, lambda kav: (kav, param),
+                "Data/params/tasks",
+                lambda name, kav: "Data/params/"+name+"_"+str(kav)+".pickle",
+                processes=processes, seeds=seeds,
+                common_random_numbers=common_random_numbers,
+                checkpoint_interval=checkpoint_interval, batch=batch,
+                show_labels=False, solver=solver, observables='per2')
+    runner.run(kavs, initial_values)
 
 kavs = [0.1, 0.2, 0.5, 1, 2, 5, 10]
 
+simulate_trajectories(kavs)
 for kav in kavs:
-    simulate_trajectories(kav)
     traj = load_trajectories(kav)
 
 
@@ -17,6 +17,17 @@ from scipy import stats
 
 from local_imports import PlotOptions as plo
 
+# set True for sweeps simulated with common random numbers, where the WT
+# and knockouts of each replicate are paired: a Wilcoxon signed-rank test
+# on the paired MIC values then replaces the Mann-Whitney U test
+paired = False
+
+def compare(x, y):
+    """ two-sided p-value for a difference between MIC samples x and y """
+    if paired:
+        return stats.wilcoxon(x, y)[1]
+    return stats.mannwhitneyu(x, y, alternative='two-sided')[1]
+
 # first, the figure for parameter switching
 kavs = [0.1, 0.2, 0.5, 1, 2, 5, 10]
 
@@ -26,7 +37,8 @@ with open("results/params_mic_results.pickle", "rb") as input_file:
 
 # run the stats
 # compare avpbmalko and vipbmalko vs. wt for all cases
-# running a mann-whitney U test for nonparametric comparison
+# running a mann-whitney U test for nonparametric comparison (or the
+# paired wilcoxon test, see compare)
 # recap of phenotypes is: AVPBmal1ko < VIPBmal1KO = WT
 # signifiance of p < 0.05
 # correct p-values with Bonferroni correction
@@ -34,9 +46,9 @@ with open("results/params_mic_results.pickle", "rb") as input_file:
 # comparisons
 u_results = []
 for r in results:
-    wa = stats.mannwhitneyu(r[0], r[1], alternative='two-sided')[1]
-    wv = stats.mannwhitneyu(r[0], r[2], alternative='two-sided')[1]
-    av = stats.mannwhitneyu(r[1], r[2], alternative='two-sided')[1]
+    wa = compare(r[0], r[1])
+    wv = compare(r[0], r[2])
+    av = compare(r[1], r[2])
     u_results.append([wa, wv, av])
 u_results = np.array(u_results)*21
 
@@ -94,7 +106,8 @@ with open("results/celltypes_mic_results.pickle", "rb") as input_file:
 
 # run the stats
 # compare avpbmalko and vipbmalko vs. wt for all cases
-# running a mann-whitney U test for nonparametric comparison
+# running a mann-whitney U test for nonparametric comparison (or the
+# paired wilcoxon test, see compare)
 # recap of phenotypes is: AVPBmal1ko < VIPBmal1KO = WT
 # signifiance of p < 0.05
 # correct p-values with Bonferroni correction
@@ -102,9 +115,9 @@ with open("results/celltypes_mic_results.pickle", "rb") as input_file:
 # comparisons
 u_results = []
 for r in results:
-    wa = stats.mannwhitneyu(r[0], r[1], alternative='two-sided')[1]
-    wv = stats.mannwhitneyu(r[0], r[2], alternative='two-sided')[1]
-    av = stats.mannwhitneyu(r[1], r[2], alternative='two-sided')[1]
+    wa = compare(r[0], r[1])
+    wv = compare(r[0], r[2])
+    av = compare(r[1], r[2])
     u_results.append([wa, wv, av])
 u_results = np.array(u_results)*21
 
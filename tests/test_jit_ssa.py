@@ -0,0 +1,38 @@
+"""
+Checks the numba-compiled direct method (solver='jit') against the NumPy
+direct method on the 120-cell WT configuration. Skipped unless numba and
+gillespy are installed; run from the repository root with
+python -m pytest tests. Its speed is measured by benchmark_solvers.py.
+"""
+
+from __future__ import division
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+pytest.importorskip('gillespy')
+
+from local_models.scn_model import scn_structure
+from local_models.stoch_engine import simulate
+
+
+def wt_network():
+    network = scn_structure(53, 27, 40, 2.5).network('None')
+    x0 = np.trunc(np.random.RandomState(0).rand(network.n_species)*300)
+    return network.with_x0(x0)
+
+
+def test_jit_matches_direct():
+    """ jit and direct agree on the ensemble mean within sampling error """
+    network = wt_network()
+    tspan = np.linspace(0, 0.2, 3)
+    runs = 50
+    finals = {}
+    for solver in ['jit', 'direct']:
+        finals[solver] = np.array(
+            [simulate(network, tspan, seed=seed, solver=solver,
+                      observables='per2')[0][-1, 1:]
+             for seed in range(runs)])
+    sem = np.sqrt((finals['jit'].var(0) + finals['direct'].var(0))/runs)
+    difference = np.abs(finals['jit'].mean(0) - finals['direct'].mean(0))
+    assert np.all(difference < 5*sem + 1)
@@ -0,0 +1,32 @@
+"""
+Checks the batched model evaluation of LimitCycle.Oscillator. Skipped
+unless CasADi and matplotlib are installed; run from the repository root
+with python -m pytest tests.
+"""
+
+from __future__ import division
+import numpy as np
+import pytest
+
+pytest.importorskip('casadi')
+pytest.importorskip('matplotlib')
+
+from local_imports import LimitCycle as lc
+from local_models.gonze_model import param, ODEmodel, EqCount
+
+
+def test_batched_empty_input():
+    """ no states give empty dydt, dfdy and dfdp, without evaluating """
+    osc = lc.Oscillator(ODEmodel(), param, y0=np.ones(EqCount))
+    y = np.zeros((0, EqCount))
+    assert osc.dydt(y).shape == (0, EqCount)
+    assert osc.dfdy(y).shape == (0, EqCount, EqCount)
+    assert osc.dfdp(y).shape == (0, EqCount, osc.np)
+
+
+def test_batched_matches_rows():
+    """ a batch larger than batch_size matches row-by-row evaluation """
+    osc = lc.Oscillator(ODEmodel(), param, y0=np.ones(EqCount))
+    y = np.random.RandomState(0).rand(osc.batch_size + 3, EqCount)
+    assert np.allclose(osc.dydt(y), [osc.dydt(yi) for yi in y])
+    assert np.allclose(osc.dfdy(y), [osc.dfdy(yi) for yi in y])
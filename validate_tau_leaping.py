@@ -0,0 +1,111 @@
+"""
+Accuracy check of the adaptive tau-leaping solver against the exact SSA
+(the in-process direct method), from random initial phases.
+
+Both solvers are run from the same random initial phases. For each
+replicate we compare the mean pairwise MIC of the Per2 traces (the
+quantity used in the sweeps) and the population-mean Per2 trace. The
+tau-leaping solver is acceptable for a given epsilon when the MIC
+distributions are not distinguishable (two-sample KS test, p > 0.05)
+and the mean traces stay within three standard errors of the exact
+ensemble mean. Both solvers start from identical states, so the first
+time point is excluded.
+
+With full = True the check uses the WT configuration of the final model
+(53 AVP, 27 VIP, 40 NAV cells, kav = 2.5) over 7 periods, which costs
+hours of exact SSA per replicate. The default is a reduced configuration
+with the same cell-type proportions (9 AVP, 4 VIP, 7 NAV cells) over 2
+periods; its results are recorded in the README.
+
+John Abel
+"""
+
+from __future__ import division
+import sys
+assert sys.version[0]=='2', "This file must be run in python 2"
+import pickle
+from itertools import combinations
+from time import time
+
+import numpy as np
+from scipy import stats
+import minepy as mp
+
+from local_imports import LimitCycle as lc
+from local_models.gonze_model import param, ODEmodel, EqCount
+
+# find original period
+single_osc = lc.Oscillator(ODEmodel(), param, y0=np.ones(EqCount))
+# y0, period and limit cycle, computed once and then read from the cache
+single_osc.cached_limit_cycle('data/limit_cycles', trans=2000)
+wt_T = single_osc.T
+
+full = False
+if full:
+    AVPcells = 53; VIPcells=27; NAVcells = 40; periods = 7
+else:
+    AVPcells = 9; VIPcells=4; NAVcells = 7; periods = 2
+kav = 2.5
+
+from local_models.scn_model import CompiledSCNModel, random_phase_y0
+from local_models.seeding import SeedTree
+
+replicates = 20
+epsilons = [0.01, 0.03]
+seeds = SeedTree(0)
+
+compiled = CompiledSCNModel(AVPcells, VIPcells, NAVcells, kav,
+                            timespan=np.linspace(0, periods*wt_T,
+                                                 periods*4*24+1))
+
+def mic_of_simulation(trajectories):
+    """
+    returns the mean MIC value for one set of the SCN trajectories
+    """
+    per2 = trajectories[:, 1:]
+    mic = mp.MINE(alpha=0.6, c=15, est='mic_approx')
+    mic_values = []
+    for combo in combinations(range(per2.shape[1]), 2):
+        mic.compute_score(per2[:, combo[0]], per2[:, combo[1]])
+        mic_values.append(mic.mic())
+    return np.mean(mic_values)
+
+solvers = [('direct', {})] + [('tau_leaping', {'epsilon': eps})
+                              for eps in epsilons]
+results = dict((solver+str(opts.get('epsilon', '')),
+               {'mic': [], 'mean_per2': [], 'time': 0.})
+               for solver, opts in solvers)
+
+for tn in range(replicates):
+    print tn,
+    y0_random = random_phase_y0(single_osc, AVPcells, VIPcells, NAVcells,
+                                seeds.child(tn, 'initial').random_state())
+
+    for solver, opts in solvers:
+        res = results[solver+str(opts.get('epsilon', ''))]
+        start = time()
+        traj = compiled.run(y0_random, show_labels=False,
+                            seed=seeds.child(tn, 'simulation'),
+                            solver=solver, observables='per2', **opts)[0]
+        res['time'] += time() - start
+        res['mic'].append(mic_of_simulation(traj))
+        res['mean_per2'].append(traj[:, 1:].mean(1))
+
+# compare each tau-leaping run to the exact SSA
+exact = results['direct']
+exact_mean = np.mean(exact['mean_per2'], 0)
+exact_sem = np.std(exact['mean_per2'], 0)/np.sqrt(replicates)
+print
+print "direct: %0.1f s per run, mean MIC %0.3f" % (
+        exact['time']/replicates, np.mean(exact['mic']))
+for eps in epsilons:
+    res = results['tau_leaping'+str(eps)]
+    ks_p = stats.ks_2samp(exact['mic'], res['mic'])[1]
+    trace_err = np.abs(np.mean(res['mean_per2'], 0) - exact_mean)
+    print ("tau_leaping eps=%0.2f: %0.1f s per run (%0.1fx), mean MIC %0.3f,"
+           " KS p=%0.3f, max |mean trace error|/SEM %0.2f") % (
+            eps, res['time']/replicates, exact['time']/res['time'],
+            np.mean(res['mic']), ks_p, np.max(trace_err[1:]/exact_sem[1:]))
+
+with open("results/tau_leaping_validation.pickle", "wb") as output_file:
+    pickle.dump(results, output_file)